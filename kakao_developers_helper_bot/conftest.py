@@ -0,0 +1 @@
+# puts the app directory on sys.path so tests import kakao_developers_helper_bot the way pc run does
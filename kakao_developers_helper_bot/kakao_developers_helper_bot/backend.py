@@ -0,0 +1,121 @@
+import argparse
+import os
+
+from langchain.embeddings import OpenAIEmbeddings
+from llm_client.client import LlmClient
+
+from kakao_developers_helper_bot.langchain_call.chroma_collection_registry import collection_registry
+from kakao_developers_helper_bot.langchain_call.chroma_db_repository import ChromaDbRepository
+from kakao_developers_helper_bot.langchain_call.context_assembler import ContextAssembler
+from kakao_developers_helper_bot.langchain_call.conversation_store import ConversationStore
+from kakao_developers_helper_bot.langchain_call.embedding_cache import CachedEmbeddings, EmbeddingCache
+from kakao_developers_helper_bot.langchain_call.lazy import Lazy
+from kakao_developers_helper_bot.langchain_call.llm_gateway import GovernedEmbeddings, llm_gateway
+from kakao_developers_helper_bot.langchain_call.numpy_vector_store import NumpyVectorStore
+from kakao_developers_helper_bot.langchain_call.semantic_answer_cache import SemanticAnswerCache
+from kakao_developers_helper_bot.langchain_call.shared_backend import RemoteChromaDbRepository, \
+    RemoteSemanticAnswerCache, connect, serve
+
+project3_data_dir = os.path.join(os.getcwd(), "assets/project3_data")
+chroma_persist_dir = os.path.join(os.getcwd(), "assets/chroma_persist")
+history_dir = os.path.join(os.getcwd(), "assets/history")
+# empty: every process opens the stores itself (development); "host:port" or a socket path: use the shared backend
+backend_address = os.environ.get("KAKAO_BOT_BACKEND_ADDRESS", "")
+# the backend speaks pickle, so the key is what stands between the socket and arbitrary code execution
+backend_authkey = os.environ.get("KAKAO_BOT_BACKEND_AUTHKEY", "").encode("utf-8")
+default_backend_address = os.path.join(os.getcwd(), "assets/backend.sock")
+shared_names = ["chroma_db_repository", "answer_cache", "embedding_cache", "chat_store"]
+# "chroma" (duckdb+parquet) or "numpy" (mmap segments, with KAKAO_BOT_VECTOR_DTYPE float32/float16/int8)
+vector_backend = os.environ.get("KAKAO_BOT_VECTOR_BACKEND", "chroma")
+vector_dtype = os.environ.get("KAKAO_BOT_VECTOR_DTYPE", "float32")
+# e.g. "0.5" re-ranks vector hits with maximal marginal relevance; empty keeps plain similarity order
+mmr_lambda = float(os.environ["KAKAO_BOT_MMR_LAMBDA"]) if os.environ.get("KAKAO_BOT_MMR_LAMBDA") else None
+context_assembler = ContextAssembler()
+llm_gateway.configure(
+    requests_per_minute=int(os.environ.get("OPENAI_RPM_LIMIT", "3500")),
+    tokens_per_minute=int(os.environ.get("OPENAI_TPM_LIMIT", "180000")),
+)
+# keep-alive connections, timeouts and the exact-match completion cache for every chat completion
+llm_client = LlmClient(
+    request_timeout=float(os.environ.get("OPENAI_REQUEST_TIMEOUT", "60")),
+    limiter=llm_gateway,
+    count_tokens=context_assembler.count_tokens,
+)
+# set when this process is the shared backend itself, which always opens the stores directly
+serving = False
+
+
+def require_authkey() -> bytes:
+    if not backend_authkey:
+        raise RuntimeError("KAKAO_BOT_BACKEND_AUTHKEY must be set to a secret when the shared backend is used")
+    return backend_authkey
+
+
+def use_shared_backend() -> bool:
+    return bool(backend_address) and not serving
+
+
+if backend_address:
+    require_authkey()
+
+
+def create_chroma_db_repository():
+    if use_shared_backend():
+        return RemoteChromaDbRepository(shared_backend.get().chroma_db_repository())
+    vector_store = NumpyVectorStore(os.path.join(chroma_persist_dir, "vectors"), vector_dtype) \
+        if vector_backend == "numpy" else None
+    repository = ChromaDbRepository(chroma_persist_dir, project3_data_dir, vector_store=vector_store,
+                                    mmr_lambda=mmr_lambda)
+    repository.warm_up()
+    return repository
+
+
+def create_answer_cache():
+    if use_shared_backend():
+        return RemoteSemanticAnswerCache(shared_backend.get().answer_cache())
+    return SemanticAnswerCache(f"{chroma_persist_dir}/answer_cache", chroma_db_repository.get().corpus_version)
+
+
+def create_embedding_cache():
+    if use_shared_backend():
+        return shared_backend.get().embedding_cache()
+    return EmbeddingCache(os.path.join(os.getcwd(), "assets/embedding_cache"))
+
+
+def create_chat_store():
+    if use_shared_backend():
+        return shared_backend.get().chat_store()
+    return ConversationStore(os.path.join(history_dir, "conversations.db"))
+
+
+shared_backend = Lazy("shared_backend", lambda: connect(backend_address, backend_authkey, shared_names))
+embedding_cache = Lazy("embedding_cache", create_embedding_cache)
+collection_registry.set_embedding_factory(lambda: CachedEmbeddings(
+    GovernedEmbeddings(OpenAIEmbeddings(max_retries=1), llm_gateway, context_assembler.count_tokens),
+    embedding_cache.get(),
+))
+chroma_db_repository = Lazy("chroma_db_repository", create_chroma_db_repository)
+answer_cache = Lazy("answer_cache", create_answer_cache)
+chat_store = Lazy("chat_store", create_chat_store)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the vector store, history and caches to all backend workers")
+    parser.add_argument("--address", default=backend_address or default_backend_address,
+                        help='a unix socket path (default) or "host:port"')
+    args = parser.parse_args()
+    authkey = require_authkey()
+
+    global serving
+    serving = True
+    chroma_db_repository.get()
+    serve(args.address, authkey, {
+        "chroma_db_repository": chroma_db_repository.get,
+        "answer_cache": answer_cache.get,
+        "embedding_cache": embedding_cache.get,
+        "chat_store": chat_store.get,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+import tiktoken
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+from langchain.schema.embeddings import Embeddings
+
+_encoding: Optional[tiktoken.Encoding] = None
+_encoding_loaded = False
+
+
+# tiktoken downloads its BPE file on first use; offline the fakes fall back to a rough byte-based count
+def _count_tokens(text: str) -> int:
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"tiktoken encoding unavailable ({type(e).__name__}), estimating tokens from utf-8 length")
+    if _encoding is None:
+        return (len(text.encode("utf-8")) + 2) // 3
+    return len(_encoding.encode(text))
+
+
+def fake_completion(prompt: str) -> str:
+    stripped = prompt.rstrip()
+    if stripped.endswith("Job:"):
+        return "search_kakao_wiki" if "<information>\n</information>" in prompt else "response"
+    if stripped.endswith("wiki_page:"):
+        question = prompt[prompt.rfind("User Questions:"):]
+        if "소셜" in question or "social" in question:
+            return "kakao_social"
+        if "채널" in question or "channel" in question:
+            return "kakao_talk_channel"
+        return "kakao_sink"
+    if "You must answer Y or N" in prompt:
+        return "Y"
+    if stripped.endswith("Compressed:"):
+        return prompt[prompt.find("<search_results>"):][:200]
+    information = prompt[prompt.find("<information>"):][:200]
+    return f"(fake answer) {information}"
+
+
+class FakeChatModel(BaseChatModel):
+    latency: float = 0.2
+    token_latency: float = 0.0
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _complete(self, messages: List[BaseMessage]) -> ChatResult:
+        prompt = "\n".join(message.content for message in messages)
+        completion = fake_completion(prompt)
+        prompt_tokens = _count_tokens(prompt)
+        completion_tokens = _count_tokens(completion)
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=completion))],
+            llm_output={"token_usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                        "total_tokens": prompt_tokens + completion_tokens}},
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        result = self._complete(messages)
+        if run_manager is not None:
+            for token in result.generations[0].message.content.split(" "):
+                time.sleep(self.token_latency)
+                run_manager.on_llm_new_token(token + " ")
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        result = self._complete(messages)
+        if run_manager is not None:
+            for token in result.generations[0].message.content.split(" "):
+                await asyncio.sleep(self.token_latency)
+                await run_manager.on_llm_new_token(token + " ")
+        return result
+
+    def reset(self) -> None:
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+
+class FakeEmbeddings(Embeddings):
+    model: str
+    _size: int
+    _latency: float
+    _lock: threading.Lock
+    calls: int = 0
+    texts: int = 0
+
+    def __init__(self, size: int = 256, latency: float = 0.05) -> None:
+        self.model = f"fake-embedding-{size}"
+        self._size = size
+        self._latency = latency
+        self._lock = threading.Lock()
+
+    # hashed character bigrams, so texts sharing words land close to each other
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self._size, dtype=np.float32)
+        compact = "".join(text.split())
+        for i in range(max(len(compact) - 1, 1)):
+            digest = hashlib.md5(compact[i:i + 2].encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self._size] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self._latency)
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class FakeSearch:
+    _latency: float
+    calls: int = 0
+
+    def __init__(self, latency: float = 0.3) -> None:
+        self._latency = latency
+
+    def __call__(self, query: str) -> str:
+        time.sleep(self._latency)
+        self.calls += 1
+        return f"{query} 에 대한 검색 결과입니다. 카카오 디벨로퍼스 문서를 참고하세요."
@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from kakao_developers_helper_bot.benchmark.fakes import FakeChatModel, FakeEmbeddings, FakeSearch
+from kakao_developers_helper_bot.langchain_call.chroma_collection_registry import ChromaCollectionRegistry
+from kakao_developers_helper_bot.langchain_call.chroma_db_repository import ChromaDbRepository
+from kakao_developers_helper_bot.langchain_call.lang_chain_assistant import LangChainAssistant
+from kakao_developers_helper_bot.langchain_call.local_router import LocalRouter
+from kakao_developers_helper_bot.langchain_call.numpy_vector_store import NumpyVectorStore
+from kakao_developers_helper_bot.langchain_call.tracing import tracer
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "assets")
+
+QUESTIONS = [
+    "카카오싱크 도입 절차를 알려줘",
+    "카카오싱크 간편가입은 어떤 기능이야?",
+    "카카오 소셜 로그인은 어떻게 연동해?",
+    "카카오톡 채널 메시지는 어떻게 보내?",
+    "카카오톡 채널 추가 API 가 있어?",
+    "카카오싱크 검수 기준이 뭐야?",
+]
+
+
+class StageTimer:
+    _durations: dict[str, list[float]]
+
+    def __init__(self) -> None:
+        self._durations = defaultdict(list)
+
+    def record(self, stage: str, seconds: float) -> None:
+        self._durations[stage].append(seconds)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {stage: percentiles(durations) for stage, durations in sorted(self._durations.items())}
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)) * 1000, 2),
+        "p99_ms": round(float(np.percentile(values, 99)) * 1000, 2),
+    }
+
+
+def write_corpus(data_dir: str, scale: int) -> None:
+    source_dir = os.path.join(ASSETS_DIR, "project3_data")
+    os.makedirs(data_dir, exist_ok=True)
+    for file in os.listdir(source_dir):
+        with open(os.path.join(source_dir, file), "r", encoding="utf-8") as f:
+            paragraphs = f.read().split("\n\n")
+        with open(os.path.join(data_dir, file), "w", encoding="utf-8") as f:
+            for copy in range(scale):
+                suffix = f" (copy {copy})" if copy else ""
+                f.write("\n\n".join(paragraph + suffix for paragraph in paragraphs))
+                f.write("\n\n")
+
+
+def open_repository(work_dir: str, embeddings: FakeEmbeddings, vector_backend: str = "chroma") -> ChromaDbRepository:
+    persist_dir = os.path.join(work_dir, "chroma_persist")
+    registry = ChromaCollectionRegistry(embedding_factory=lambda: embeddings)
+    vector_store = None
+    if vector_backend != "chroma":
+        # "numpy" or "numpy-float16" / "numpy-int8"
+        _, _, dtype = vector_backend.partition("-")
+        vector_store = NumpyVectorStore(os.path.join(persist_dir, "vectors"), dtype or "float32")
+    return ChromaDbRepository(persist_dir, os.path.join(work_dir, "data"), registry=registry,
+                              vector_store=vector_store)
+
+
+def build_repository(work_dir: str, scale: int, embeddings: FakeEmbeddings,
+                     vector_backend: str = "chroma") -> ChromaDbRepository:
+    write_corpus(os.path.join(work_dir, "data"), scale)
+    return open_repository(work_dir, embeddings, vector_backend)
+
+
+def bench_corpus(scale: int, vector_backend: str, args: argparse.Namespace) -> dict:
+    work_dir = tempfile.mkdtemp(prefix=f"kakao_bench_{scale}_")
+    try:
+        embeddings = FakeEmbeddings(latency=args.embedding_latency)
+        repository = build_repository(work_dir, scale, embeddings, vector_backend)
+
+        started_at = time.perf_counter()
+        progress = repository.push_texts()
+        ingest_seconds = time.perf_counter() - started_at
+
+        # a fresh repository measures what a new worker pays to open the store and answer its first query
+        started_at = time.perf_counter()
+        repository = open_repository(work_dir, embeddings, vector_backend)
+        repository.query_db(QUESTIONS[0], search_mode="vector")
+        open_seconds = time.perf_counter() - started_at
+
+        retrieval = {}
+        for search_mode in ("vector", "lexical", "hybrid"):
+            durations = []
+            for i in range(args.queries):
+                started_at = time.perf_counter()
+                repository.query_db(QUESTIONS[i % len(QUESTIONS)], search_mode=search_mode)
+                durations.append(time.perf_counter() - started_at)
+            retrieval[search_mode] = percentiles(durations)
+
+        return {
+            "scale": scale,
+            "vector_backend": vector_backend,
+            "chunks": progress.chunks_added,
+            "ingest_seconds": round(ingest_seconds, 3),
+            "open_ms": round(open_seconds * 1000, 2),
+            "ingest_chunks_per_second": round(progress.chunks_added / ingest_seconds, 1) if ingest_seconds else 0,
+            "embedding_calls": embeddings.calls,
+            "retrieval": retrieval,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def instrument(assistant: LangChainAssistant, repository: ChromaDbRepository, timer: StageTimer) -> None:
+    run_chain = assistant._arun_chain
+
+    async def timed_run_chain(chain, context, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await run_chain(chain, context, **kwargs)
+        finally:
+            timer.record(f"chain:{chain.output_key}", time.perf_counter() - started_at)
+
+    query_db = repository.query_db
+
+    def timed_query_db(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return query_db(*args, **kwargs)
+        finally:
+            timer.record("query_db", time.perf_counter() - started_at)
+
+    search = assistant.asearch
+
+    async def timed_search(query):
+        started_at = time.perf_counter()
+        try:
+            return await search(query)
+        finally:
+            timer.record("web_search", time.perf_counter() - started_at)
+
+    assistant._arun_chain = timed_run_chain
+    repository.query_db = timed_query_db
+    assistant.asearch = timed_search
+
+
+async def bench_turns(args: argparse.Namespace) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="kakao_bench_turns_")
+    try:
+        embeddings = FakeEmbeddings(latency=args.embedding_latency)
+        repository = build_repository(work_dir, 1, embeddings)
+        repository.push_texts()
+
+        llm = FakeChatModel(latency=args.llm_latency)
+        streaming_llm = FakeChatModel(latency=args.llm_latency)
+        search = FakeSearch(latency=args.search_latency)
+        started_at = time.perf_counter()
+        router = LocalRouter(repository, os.path.join(work_dir, "routing.jsonl")) if args.router else None
+        assistant = LangChainAssistant(
+            os.path.join(work_dir, "history"), os.path.join(ASSETS_DIR, "template"), repository,
+            router=router, llm=llm, streaming_llm=streaming_llm, search_func=search,
+        )
+        assistant_init_seconds = time.perf_counter() - started_at
+        timer = StageTimer()
+        instrument(assistant, repository, timer)
+
+        turn_durations, calls_per_turn, tokens_per_turn = [], [], []
+        for i in range(args.turns):
+            for model in (llm, streaming_llm):
+                model.reset()
+            started_at = time.perf_counter()
+            await assistant.agenerate_answer(QUESTIONS[i % len(QUESTIONS)], conversation_id=f"bench-{i}")
+            turn_durations.append(time.perf_counter() - started_at)
+            calls_per_turn.append(llm.calls + streaming_llm.calls)
+            tokens_per_turn.append(llm.prompt_tokens + llm.completion_tokens
+                                   + streaming_llm.prompt_tokens + streaming_llm.completion_tokens)
+
+        return {
+            "turns": args.turns,
+            "assistant_init_ms": round(assistant_init_seconds * 1000, 2),
+            "turn": percentiles(turn_durations),
+            "stages": timer.summary(),
+            "llm_calls_per_turn": round(float(np.mean(calls_per_turn)), 2),
+            "tokens_per_turn": round(float(np.mean(tokens_per_turn)), 1),
+            "web_search_calls": search.calls,
+            "metrics": tracer.metrics()["counters"],
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmark with fake LLM, embedding and search backends")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--scales", default="1,4,16", help="corpus sizes as multiples of assets/project3_data")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--vector-backends", default="chroma,numpy",
+                        help="vector stores to compare: chroma, numpy, numpy-float16, numpy-int8")
+    parser.add_argument("--router", action="store_true", help="enable the local job/wiki page router")
+    parser.add_argument("--output", default="", help="write the report as JSON to this path")
+    args = parser.parse_args()
+
+    report = {
+        "corpus": [bench_corpus(int(scale), vector_backend, args)
+                   for scale in args.scales.split(",") for vector_backend in args.vector_backends.split(",")],
+        "agent": asyncio.run(bench_turns(args)),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
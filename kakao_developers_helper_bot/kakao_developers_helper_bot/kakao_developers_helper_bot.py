@@ -1,186 +1,362 @@
+import asyncio
+import json
 import os
 from datetime import datetime
 
 import openai
 from pynecone import Base
 import pynecone as pc
-from typing import List
-from langchain.chains import SequentialChain
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts.chat import ChatPromptTemplate
-from langchain.chains import LLMChain
+from typing import AsyncIterator, List, Optional
 
-from kakao_developers_helper_bot.langchain_call.chroma_db_repository import ChromaDbRepository
+from kakao_developers_helper_bot.backend import answer_cache, chat_store, chroma_db_repository, context_assembler, \
+    embedding_cache, history_dir, llm_client
 from kakao_developers_helper_bot.langchain_call.lang_chain_assistant import LangChainAssistant
+from kakao_developers_helper_bot.langchain_call.lazy import Lazy
+from kakao_developers_helper_bot.langchain_call.llm_gateway import LlmUnavailableError
+from kakao_developers_helper_bot.langchain_call.local_router import LocalRouter
+from kakao_developers_helper_bot.langchain_call.tracing import tracer
 
-openai.api_key = os.environ['OPENAI_API_KEY']
-with open('assets/kakaosink.txt', 'r', encoding='utf-8') as file:
-    kakao_sink_contents = file.read()
+openai.api_key = os.environ.get('OPENAI_API_KEY')
 
-kakao_sink_path = os.path.join(os.getcwd(), "assets/kakaosink.txt")
-project3_data_dir = os.path.join(os.getcwd(), "assets/project3_data")
-chroma_persist_dir = os.path.join(os.getcwd(), "assets/chroma_persist")
-chroma_db_repository = ChromaDbRepository(chroma_persist_dir, project3_data_dir)
-history_dir = os.path.join(os.getcwd(), "assets/history")
 template_dir = os.path.join(os.getcwd(), "assets/template")
-langchain_assistant = LangChainAssistant(history_dir, template_dir, chroma_db_repository)
+tracer.configure(export_path=os.path.join(os.getcwd(), "assets/logs/trace.jsonl"))
+
+langchain_assistant = Lazy("langchain_assistant", lambda: LangChainAssistant(
+    history_dir, template_dir, chroma_db_repository.get(), answer_cache=answer_cache.get(),
+    router=LocalRouter(chroma_db_repository.get(), os.path.join(os.getcwd(), "assets/logs/routing.jsonl")),
+    conversation_store=chat_store.get(), llm_client=llm_client,
+))
+if os.environ.get("KAKAO_BOT_WARM_UP") == "1":
+    langchain_assistant.warm_up_in_background()
+# number of turns a session keeps in State.messages; older ones are paged in from chat_store
+message_page_size = 20
 
 class Message(Base):
+    id: int = 0
     question: str
     answer: str
     created_at: str
 
 
-def call_assistant(question: str, prev_messages: List[Message]) -> str:
-    system_instruction = f"당신은 유능한 어시스턴트 입니다. 모든 질문은 3줄 이내로 답변하세요."
+def to_message(turn: dict) -> Message:
+    return Message(
+        id=turn["id"],
+        question=turn["question"],
+        answer=turn["answer"],
+        created_at=datetime.fromtimestamp(turn["created_at"]).strftime("%B %d, %Y %I:%M %p"),
+    )
+
+
+def build_messages(system_instruction: str, question: str, prev_messages: List[Message]) -> list[dict]:
     messages = [
         {"role": "system", "content": system_instruction}
     ]
-    for prev_message in prev_messages:
-        messages.append({"role": "user", "content": prev_message.question})
-        messages.append({"role": "assistant", "content": prev_message.answer})
+    # State.messages is newest first; replay the most recent turns that fit the budget in chronological order
+    turns = context_assembler.fit_turns([(m.question, m.answer) for m in reversed(prev_messages)])
+    for prev_question, prev_answer in turns:
+        messages.append({"role": "user", "content": prev_question})
+        messages.append({"role": "assistant", "content": prev_answer})
 
     messages.append({"role": "user", "content": question})
+    return messages
 
-    response = openai.ChatCompletion.create(model="gpt-3.5-turbo-16k", messages=messages)
-    answer = response['choices'][0]['message']['content']
 
-    return answer
+async def join_stream(stream: AsyncIterator[str]) -> str:
+    return "".join([token async for token in stream])
+
+
+async def stream_call_assistant(question: str, prev_messages: List[Message]) -> AsyncIterator[str]:
+    system_instruction = f"당신은 유능한 어시스턴트 입니다. 모든 질문은 3줄 이내로 답변하세요."
+    messages = build_messages(system_instruction, question, prev_messages)
+
+    with tracer.span("chat_completion", "simple", prompt_tokens=llm_client.count_message_tokens(messages)) as span:
+        response = await llm_client.astream_chat(messages, model="gpt-3.5-turbo-16k")
+        span.set(cache_hit=response.cached)
+        text = ""
+        async for delta in response:
+            content = delta.get('content')
+            if content:
+                text += content
+                yield content
+        # chunks are not tokens; a cache hit replays the whole answer as one chunk
+        span.set(completion_tokens=llm_client.count_tokens(text))
+
+
+async def call_assistant(question: str, prev_messages: List[Message]) -> str:
+    return await join_stream(stream_call_assistant(question, prev_messages))
+
 
+product_descriptions = {
+    "kakao_sink": "kakao 의 신규 서비스 카카오싱크 ( kakaosink ) 에 대한 정보를 검색합니다. 이 정보는 기능, 과정, 도입안내를 포함합니다",
+    "kakao_social": "카카오 소셜 ( kakao social ) 에 대한 정보를 검색합니다. 카카오 로그인, 사용자 정보, 친구 목록 등을 포함합니다",
+    "kakao_talk_channel": "카카오톡 채널 ( kakao talk channel ) 에 대한 정보를 검색합니다. 채널 추가, 메시지, 관계 확인 등을 포함합니다",
+}
+
+query_parameter = {
+    "type": "string",
+    "description": "문서에서 검색할 질문 또는 키워드",
+}
 
 functions = [{
-    "name": "kakao_sink_information",
-    "description": "kakao 의 신규 서비스 카카오싱크 ( kakaosink ) 에 대한 전반적인 정보를 가져옵니다. 이 정보는 기능, 과정, 도입안내를 포함합니다",
+    "name": f"{product}_information",
+    "description": description,
+    "parameters": {
+        "type": "object",
+        "properties": {"query": query_parameter},
+        "required": ["query"]
+    }
+} for product, description in product_descriptions.items()] + [{
+    "name": "kakao_products_information",
+    "description": "여러 카카오 서비스에 걸친 질문일 때, 선택한 서비스들의 정보를 한 번에 검색합니다",
     "parameters": {
         "type": "object",
-        "properties": {},
-        "required": []
+        "properties": {
+            "products": {"type": "array", "items": {"type": "string", "enum": list(product_descriptions.keys())}},
+            "query": query_parameter,
+        },
+        "required": ["products", "query"]
     }
 }]
 
 
-def function_call_assistant(question: str, prev_messages: List[Message]):
-    system_instruction = f"당신은 유능한 어시스턴트 입니다."
-    messages = [
-        {"role": "system", "content": system_instruction}
-    ]
-    for prev_message in prev_messages:
-        messages.append({"role": "user", "content": prev_message.question})
-        messages.append({"role": "assistant", "content": prev_message.answer})
+async def resolve_function_call(function_name: str, arguments: str, question: str, k: int = 4) -> str:
+    try:
+        parsed_arguments = json.loads(arguments) if arguments else {}
+    except json.JSONDecodeError:
+        parsed_arguments = {}
+    query = parsed_arguments.get("query") or question
+    if function_name == "kakao_products_information":
+        products = [product for product in parsed_arguments.get("products", []) if product in product_descriptions]
+    else:
+        products = [function_name.removesuffix("_information")]
+    products = [product for product in products if product in product_descriptions] or list(product_descriptions)
 
-    messages.append({"role": "user", "content": question})
+    repository = await chroma_db_repository.aget()
+    if len(products) == 1:
+        return f"[{products[0]}]\n" + "\n".join(await repository.aquery_db(query, collection_name=products[0], k=k))
+    # one query embedding searched across every product; chunks come back ranked together with their source
+    chunks = await repository.aquery_sources(query, products, k_per_source=k)
+    return "\n\n".join(f"[{chunk['source']}] {chunk['text']}" for chunk in chunks)
 
-    for i in range(0, 3):
-        completion = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo-16k",
-            messages=messages,
-            functions=functions,
-            function_call="auto",
-            max_tokens=8192
-        )
 
-        if "function_call" in completion['choices'][0]['message']:
-            function_name = completion["choices"][0]["message"]["function_call"]["name"]
-            print(f"call {function_name}")
-            messages.append({"role": "assistant", "content": f"call {function_name}"})
-            messages.append({"role": "user",
-                             "content": f"kakao_sink_information 함수의 결과입니다 \n\n {kakao_sink_contents} \n\n {question}"})
-        else:
-            return completion['choices'][0]['message']['content']
+async def stream_function_call_assistant(question: str, prev_messages: List[Message]) -> AsyncIterator[str]:
+    system_instruction = f"당신은 유능한 어시스턴트 입니다."
+    messages = build_messages(system_instruction, question, prev_messages)
 
-    return "반복 function 호출로 결과 load에 실패하였습니다"
+    for i in range(0, 3):
+        with tracer.span("chat_completion", "function_call",
+                         prompt_tokens=llm_client.count_message_tokens(messages)) as span:
+            response = await llm_client.astream_chat(
+                messages,
+                model="gpt-3.5-turbo-16k",
+                functions=functions,
+                function_call="auto",
+                max_tokens=8192,
+            )
+            span.set(cache_hit=response.cached)
+
+            function_name = None
+            arguments = ""
+            text = ""
+            async for delta in response:
+                if "function_call" in delta:
+                    function_name = (function_name or "") + delta["function_call"].get("name", "")
+                    arguments += delta["function_call"].get("arguments", "")
+                elif delta.get("content"):
+                    text += delta["content"]
+                    yield delta["content"]
+            span.set(function_name=function_name, completion_tokens=llm_client.count_tokens(text + arguments))
+
+        if function_name is None:
+            return
+
+        messages.append({"role": "assistant", "content": None,
+                         "function_call": {"name": function_name, "arguments": arguments}})
+        messages.append({"role": "function", "name": function_name,
+                         "content": await resolve_function_call(function_name, arguments, question)})
+
+    yield "반복 function 호출로 결과 load에 실패하였습니다"
+
+
+async def function_call_assistant(question: str, prev_messages: List[Message]):
+    return await join_stream(stream_function_call_assistant(question, prev_messages))
+
+
+async def lookup_answer(question: str, mode: str) -> Optional[str]:
+    with tracer.span("cache", "answer_cache") as span:
+        try:
+            cached_answer = await (await answer_cache.aget()).alookup(question, mode)
+        except LlmUnavailableError:
+            # the lookup embeds the question; with the breaker open that is just a miss
+            cached_answer = None
+        span.set(cache_hit=cached_answer is not None)
+    return cached_answer
+
+
+async def select_vector_db(question: str, prev_messages: List[Message]):
+    cached_answer = await lookup_answer(question, "select_vector_db")
+    if cached_answer is not None:
+        return cached_answer
+
+    repository, cache = await chroma_db_repository.aget(), await embedding_cache.aget()
+    with tracer.span("cache", "embedding_cache") as span:
+        before = cache.stats()
+        answers = await repository.aquery_db(question)
+        after = cache.stats()
+        # the counters are process-wide; the span reports what this query added to them
+        span.set(entries=after["entries"], hits=after["hits"] - before["hits"],
+                 misses=after["misses"] - before["misses"])
+    answer = ",".join(answers)
+    await (await answer_cache.aget()).astore(question, answer, "select_vector_db")
+    return answer
 
+async def degraded_answer(question: str, error: LlmUnavailableError) -> str:
+    # lexical only: the vector search and the answer cache both need the API that just failed
+    with tracer.span("degraded", "select_vector_db", reason=str(error)):
+        repository = await chroma_db_repository.aget()
+        answer = ",".join(await repository.aquery_db(question, search_mode="lexical"))
+    return f"답변 생성이 지연되고 있어 관련 문서를 먼저 보여드립니다.\n\n{answer}"
 
-def read_prompt_template(file_path: str) -> str:
-    with open(file_path, "r") as f:
-        prompt_template = f.read()
+async def call_langchain_assistant(question: str, conversation_id: str):
+    return await (await langchain_assistant.aget()).agenerate_answer(question, conversation_id)
 
-    return prompt_template
 
+async def stream_langchain_assistant(question: str, conversation_id: str) -> AsyncIterator[str]:
+    assistant = await langchain_assistant.aget()
+    async for token in assistant.astream_answer(question, conversation_id):
+        yield token
+
+def session_conversation_id(state: "State") -> str:
+    return f"ui-{state.get_token()}"
 
-def create_chain(llm, template_path, output_key):
-    return LLMChain(
-        llm=llm,
-        prompt=ChatPromptTemplate.from_template(
-            template=read_prompt_template(template_path),
-        ),
-        output_key=output_key,
-        verbose=True,
-    )
 
-def select_vector_db(question: str, prev_messages: List[Message]):
-    answers = chroma_db_repository.query_db(question)
-    print(answers)
-    return ",".join(answers)
+# pynecone turns public State methods into event handlers and underscore names into backend vars,
+# so the helpers the handlers share take the state as an argument instead
+async def output(state: "State", func: str) -> str:
+    if not state.text.strip():
+        return "Advise will appear here."
+    try:
+        if func == "simple":
+            state.answer = await call_assistant(state.text, state.messages)
+        elif func == "function_call":
+            state.answer = await function_call_assistant(state.text, state.messages)
+        elif func == "select_vector_db":
+            state.answer = await select_vector_db(state.text, state.messages)
+        elif func == "lang_chain_call":
+            state.answer = await call_langchain_assistant(state.text, session_conversation_id(state))
+    except LlmUnavailableError as e:
+        state.answer = await degraded_answer(state.text, e)
+
+    return state.answer
+
+
+def output_stream(state: "State", func: str, prev_messages: List[Message]) -> AsyncIterator[str]:
+    if func == "simple":
+        return stream_call_assistant(state.text, prev_messages)
+    elif func == "function_call":
+        return stream_function_call_assistant(state.text, prev_messages)
+    elif func == "lang_chain_call":
+        return stream_langchain_assistant(state.text, session_conversation_id(state))
+    return None
+
+
+async def load_page(state: "State", before_id: int = None, after_id: int = None):
+    store = await chat_store.aget()
+    conversation_id = session_conversation_id(state)
+    turns = await asyncio.to_thread(store.turns, conversation_id, message_page_size, before_id, after_id)
+    if after_id is not None and len(turns) < message_page_size:
+        turns = await asyncio.to_thread(store.turns, conversation_id, message_page_size)
+    state.messages = [to_message(turn) for turn in turns]
+    state.has_older = bool(turns) and await asyncio.to_thread(
+        store.has_turns, conversation_id, turns[-1]["id"], None)
+    state.has_newer = bool(turns) and await asyncio.to_thread(
+        store.has_turns, conversation_id, None, turns[0]["id"])
+
+
+async def append_message(state: "State", question: str, answer: str):
+    store = await chat_store.aget()
+    turn_id = await asyncio.to_thread(store.append_turn, session_conversation_id(state), question, answer)
+    message = Message(id=turn_id, question=question, answer=answer,
+                      created_at=datetime.now().strftime("%B %d, %Y %I:%M %p"))
+    # bounded copy: the window never grows past message_page_size however long the session runs
+    state.has_older = state.has_older or len(state.messages) >= message_page_size
+    state.messages = [message] + state.messages[:message_page_size - 1]
+
+
+async def post_answer(state: "State", func: str):
+    question = state.text
+    if state.has_newer:
+        await load_page(state)
+    prev_messages = state.messages
+    stream = output_stream(state, func, prev_messages) if state.stream and question.strip() else None
+    if stream is None:
+        await append_message(state, question, await output(state, func))
+        return
+
+    # while streaming only `answer` changes, so each update ships one string instead of the message list
+    state.answer = ""
+    state.pending_question = question
+    yield
+    try:
+        async for token in stream:
+            state.answer += token
+            yield
+    except LlmUnavailableError as e:
+        state.answer += await degraded_answer(question, e)
+    state.pending_question = ""
+    await append_message(state, question, state.answer)
+    yield
 
-def call_langchain_assistant(question: str):
-    return langchain_assistant.generate_answer(question)
 
 class State(pc.State):
     text: str = ""
     messages: list[Message] = []
     answer: str = ""
+    stream: bool = True
+    pending_question: str = ""
+    has_older: bool = False
+    has_newer: bool = False
 
-    def output(self, func: str) -> str:
-        print(f"output {func}")
-        if not self.text.strip():
-            return "Advise will appear here."
-        if func == "simple":
-            self.answer = call_assistant(self.text, self.messages)
-        elif func == "function_call":
-            self.answer = function_call_assistant(self.text, self.messages)
-        elif func == "select_vector_db":
-            self.answer = select_vector_db(self.text, self.messages)
-        elif func == "lang_chain_call":
-            self.answer = call_langchain_assistant(self.text)
-
-        return self.answer
-
-    def post(self):
-        self.messages = \
-            [
-                Message(
-                    question=self.text,
-                    answer=self.output("simple"),
-                    created_at=datetime.now().strftime("%B %d, %Y %I:%M %p"),
-                )
-            ] + self.messages
-
-    def function_call_post(self):
-        self.messages = \
-            [
-                Message(
-                    question=self.text,
-                    answer=self.output("function_call"),
-                    created_at=datetime.now().strftime("%B %d, %Y %I:%M %p"),
-                )
-            ] + self.messages
-
-    def lang_chain_call(self):
-        self.messages = \
-            [
-                Message(
-                    question=self.text,
-                    answer=self.output("lang_chain_call"),
-                    created_at=datetime.now().strftime("%B %d, %Y %I:%M %p"),
-                )
-            ] + self.messages
-
-    def select_vector_db(self):
-        self.messages = \
-            [
-                Message(
-                    question=self.text,
-                    answer=self.output("select_vector_db"),
-                    created_at=datetime.now().strftime("%B %d, %Y %I:%M %p"),
-                )
-            ] + self.messages
-
-    def push_data(self):
-        chroma_db_repository.push_texts()
-
-    def delete(self):
-        self.messages.clear()
+    async def load_messages(self):
+        await load_page(self)
+
+    async def load_older(self):
+        if self.messages:
+            await load_page(self, before_id=self.messages[-1].id)
+
+    async def load_newer(self):
+        if self.messages:
+            await load_page(self, after_id=self.messages[0].id)
+
+    async def post(self):
+        async for _ in post_answer(self, "simple"):
+            yield
+
+    async def function_call_post(self):
+        async for _ in post_answer(self, "function_call"):
+            yield
+
+    async def lang_chain_call(self):
+        async for _ in post_answer(self, "lang_chain_call"):
+            yield
+
+    async def select_vector_db(self):
+        async for _ in post_answer(self, "select_vector_db"):
+            yield
+
+    async def push_data(self):
+        repository = await chroma_db_repository.aget()
+        progress = await asyncio.to_thread(repository.push_texts)
+        if progress.chunks_added or progress.chunks_removed:
+            cache = await answer_cache.aget()
+            await asyncio.to_thread(cache.clear)
+
+    async def delete(self):
+        store = await chat_store.aget()
+        await asyncio.to_thread(store.clear, session_conversation_id(self))
+        self.messages = []
+        self.has_older = False
+        self.has_newer = False
 
 
 def header():
@@ -220,11 +396,15 @@ def down_arrow():
 
 
 def message(message: Message):
+    return message_box(message.question, message.answer)
+
+
+def message_box(question, answer):
     return pc.box(
         pc.vstack(
-            text_box(message.question),
+            text_box(question),
             down_arrow(),
-            text_box(message.answer),
+            text_box(answer),
             spacing="0.3rem",
             align_items="left",
         ),
@@ -243,8 +423,16 @@ def index() -> pc.Component:
         pc.button("Select Vector DB", on_click=State.select_vector_db, margin_top="1rem", margin_left="1rem"),
         pc.button("LangChain Call Post", on_click=State.lang_chain_call, margin_top="1rem", margin_left="1rem"),
         pc.button("Delete", on_click=State.delete, margin_top="1rem", margin_left="1rem"),
+        pc.checkbox("Stream", is_checked=State.stream, on_change=State.set_stream, margin_top="1rem",
+                    margin_left="1rem"),
         pc.vstack(
+            pc.cond(State.has_newer, pc.button("Load Newer", on_click=State.load_newer)),
+            pc.cond(
+                State.pending_question != "",
+                message_box(State.pending_question, State.answer),
+            ),
             pc.foreach(State.messages, message),
+            pc.cond(State.has_older, pc.button("Load Older", on_click=State.load_older)),
             margin_top="2rem",
             spacing="1rem",
             align_items="left"
@@ -255,5 +443,7 @@ def index() -> pc.Component:
 
 
 app = pc.App(state=State)
-app.add_page(index)
-app.compile()
+app.add_page(index, on_load=State.load_messages)
+# backend workers can skip compiling the frontend; `pc run` and `pc export` still need it
+if os.environ.get("PC_SKIP_COMPILE") != "1":
+    app.compile()
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.schema.embeddings import Embeddings
+from langchain.vectorstores import Chroma
+
+
+class ChromaCollectionRegistry:
+    _max_size: int
+    _embedding_factory: Callable[[], Embeddings]
+    _embeddings: Embeddings = None
+    _collections: "OrderedDict[Tuple[str, str], Chroma]"
+    _lock: threading.RLock
+
+    def __init__(self, embedding_factory: Callable[[], Embeddings] = OpenAIEmbeddings, max_size: int = 16) -> None:
+        self._max_size = max_size
+        self._embedding_factory = embedding_factory
+        self._collections = OrderedDict()
+        self._lock = threading.RLock()
+
+    def set_embedding_factory(self, embedding_factory: Callable[[], Embeddings]) -> None:
+        with self._lock:
+            self._embedding_factory = embedding_factory
+            self._embeddings = None
+            self._collections.clear()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = self._embedding_factory()
+            return self._embeddings
+
+    def get(self, persist_dir: str, collection_name: str) -> Chroma:
+        key = (persist_dir, collection_name)
+        with self._lock:
+            db = self._collections.get(key)
+            if db is not None:
+                self._collections.move_to_end(key)
+                return db
+
+            db = Chroma(
+                persist_directory=persist_dir,
+                embedding_function=self.embeddings,
+                collection_name=collection_name,
+            )
+            self._collections[key] = db
+            while len(self._collections) > self._max_size:
+                evicted_key, _ = self._collections.popitem(last=False)
+                print(f"evict collection: {evicted_key[1]} ({evicted_key[0]})")
+            return db
+
+    def warm_up(self, keys: list[Tuple[str, str]]) -> None:
+        for persist_dir, collection_name in keys[:self._max_size]:
+            try:
+                self.get(persist_dir, collection_name)
+            except Exception as e:
+                print(f"FAILED warm up: {collection_name} by({e})")
+
+    def invalidate(self, persist_dir: str, collection_name: str) -> None:
+        with self._lock:
+            self._collections.pop((persist_dir, collection_name), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._collections.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._collections)
+
+
+collection_registry = ChromaCollectionRegistry()
@@ -1,25 +1,56 @@
+import asyncio
+import json
 import os
+import shutil
+import threading
 
-from typing import List
+from typing import Iterable, List, Optional, Tuple, Union
+
+import numpy as np
 from langchain.document_loaders import TextLoader
-from langchain.embeddings import OpenAIEmbeddings
 from langchain.schema import Document
 from langchain.text_splitter import CharacterTextSplitter
-from langchain.vectorstores import Chroma
-from langchain.vectorstores.base import VectorStoreRetriever
+
+from kakao_developers_helper_bot.langchain_call.chroma_collection_registry import ChromaCollectionRegistry, \
+    collection_registry
+from kakao_developers_helper_bot.langchain_call.ingestion_manifest import IngestionManifest
+from kakao_developers_helper_bot.langchain_call.ingestion_pipeline import IngestionJob, IngestionPipeline, \
+    IngestionProgress
+from kakao_developers_helper_bot.langchain_call.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from kakao_developers_helper_bot.langchain_call.tracing import tracer
+from kakao_developers_helper_bot.langchain_call.vector_store import ChromaVectorStore, VectorStore, \
+    maximal_marginal_relevance
+
+
+LAYOUT_VERSION = 2
 
 
 class ChromaDbRepository:
     _collection_name: str
     _persist_dir: str
-    _db: Chroma = None
-    _retriever: VectorStoreRetriever = None
     _data_dir: str
+    _registry: ChromaCollectionRegistry
+    _store: VectorStore
+    _mmr_lambda: Optional[float]
+    _lexical_index: LexicalIndex = None
+    _lexical_version: str = None
+    _lexical_min_coverage: float
+    _lexical_min_margin: float
+    _layout_lock: threading.Lock
 
-    def __init__(self, persist_dir: str, data_dir: str) -> None:
+    def __init__(self, persist_dir: str, data_dir: str, registry: ChromaCollectionRegistry = None,
+                 lexical_min_coverage: float = 0.9, lexical_min_margin: float = 1.3,
+                 vector_store: VectorStore = None, mmr_lambda: Optional[float] = None) -> None:
         self._collection_name = "kakao_bot"
         self._persist_dir = persist_dir
         self._data_dir = data_dir
+        self._registry = registry if registry is not None else collection_registry
+        self._store = vector_store if vector_store is not None \
+            else ChromaVectorStore(persist_dir, self._collection_name, self._registry)
+        self._mmr_lambda = mmr_lambda
+        self._lexical_min_coverage = lexical_min_coverage
+        self._lexical_min_margin = lexical_min_margin
+        self._layout_lock = threading.Lock()
 
     @staticmethod
     def _get_text(file_path: str) -> List[Document]:
@@ -27,43 +58,291 @@ class ChromaDbRepository:
         documents = loader(file_path).load()
 
         text_splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-        return text_splitter.split_documents(documents)
+        chunks = text_splitter.split_documents(documents)
+
+        # every chunk carries its file name and the nearest "#" heading so one collection can be filtered by them
+        source, _ = os.path.splitext(os.path.basename(file_path))
+        section = ""
+        for chunk in chunks:
+            headings = [line.lstrip("#").strip() for line in chunk.page_content.splitlines() if line.startswith("#")]
+            chunk_section = headings[0] if headings and chunk.page_content.startswith("#") else section
+            chunk.metadata = {"source": source, "section": chunk_section}
+            if headings:
+                section = headings[-1]
+        return chunks
+
+    def _sources(self, collection_name: Union[str, Iterable[str]]) -> List[str]:
+        names = [collection_name] if isinstance(collection_name, str) else list(collection_name)
+        if not names or any(name in ("", self._collection_name) for name in names):
+            return []
+        return list(dict.fromkeys(names))
+
+    def collection_names(self) -> list[str]:
+        names = []
+        for root, dirs, files in os.walk(self._data_dir):
+            for file in files:
+                file_name, file_extension = os.path.splitext(file)
+                names.append(file_name)
+        return names
+
+    def corpus_version(self) -> str:
+        manifest_path = os.path.join(self._persist_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return ""
+        stat = os.stat(manifest_path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def _layout_path(self) -> str:
+        return os.path.join(self._persist_dir, "layout.json")
+
+    # folds the old per-file persist directories into the single source/section tagged collection
+    def migrate_layout(self) -> None:
+        # warm_up and push_texts may both get here first
+        with self._layout_lock:
+            self._migrate_layout()
+
+    def _migrate_layout(self) -> None:
+        if os.path.exists(self._layout_path()):
+            with open(self._layout_path(), "r", encoding="utf-8") as f:
+                if json.load(f).get("version", 1) >= LAYOUT_VERSION:
+                    return
+        if not os.path.isdir(self._persist_dir):
+            os.makedirs(self._persist_dir, exist_ok=True)
+        else:
+            manifest = IngestionManifest(os.path.join(self._persist_dir, "manifest.json"))
+            for name in set(manifest.sources()) | set(self.collection_names()):
+                legacy_dir = os.path.join(self._persist_dir, name)
+                if os.path.isdir(legacy_dir):
+                    shutil.rmtree(legacy_dir, ignore_errors=True)
+                    # only once the files are gone, or a concurrent get could cache a handle to them again
+                    self._registry.invalidate(legacy_dir, name)
+                    print("MIGRATED: ", legacy_dir)
+
+            if self._store.count() > 0 and not manifest.sources():
+                # chunks pushed before the manifest existed have random ids and cannot be re-tagged in place
+                self._store.delete_all()
+                print("MIGRATED: dropped untracked chunks, run push_texts to rebuild")
+            elif self._store.count() > 0:
+                self._retag_chunks()
+                if os.path.exists(self._lexical_index_path()):
+                    self._build_lexical_index()
+
+        with open(self._layout_path(), "w", encoding="utf-8") as f:
+            json.dump({"version": LAYOUT_VERSION}, f)
+
+    def _retag_chunks(self) -> None:
+        metadatas = {}
+        for root, dirs, files in os.walk(self._data_dir):
+            for file in files:
+                file_name, _ = os.path.splitext(file)
+                try:
+                    for document in self._get_text(os.path.join(root, file)):
+                        metadatas[IngestionManifest.chunk_id(file_name, document.page_content)] = document.metadata
+                except Exception as e:
+                    print("FAILED: ", file + f"by({e})")
+
+        result = self._store.get(include=("metadatas",))
+        ids, new_metadatas = [], []
+        for chunk_id, metadata in zip(result["ids"], result["metadatas"]):
+            source, _ = os.path.splitext(os.path.basename((metadata or {}).get("source", "")))
+            ids.append(chunk_id)
+            new_metadatas.append(metadatas.get(chunk_id, {"source": source, "section": ""}))
+        if ids:
+            self._store.update_metadatas(ids, new_metadatas)
+            self._store.persist()
+
+    def warm_up(self) -> None:
+        self.migrate_layout()
+        self._store.warm_up()
 
-    def push_texts(self):
+    def _write_chunks(self, ids: list[str], documents: list[Document], embeddings: list[list[float]],
+                      removed_ids: list[str]) -> None:
+        if removed_ids:
+            self._store.delete(removed_ids)
+        if ids:
+            self._store.add(
+                ids=ids,
+                embeddings=embeddings,
+                documents=[document.page_content for document in documents],
+                metadatas=[document.metadata for document in documents],
+            )
+        self._store.persist()
+
+    def _load_jobs(self, manifest: IngestionManifest, seen_sources: set[str]) -> Iterable[IngestionJob]:
         for root, dirs, files in os.walk(self._data_dir):
             for file in files:
                 file_path = os.path.join(root, file)
                 file_name, file_extension = os.path.splitext(file)
+                seen_sources.add(file_name)
                 try:
-                    text = self._get_text(file_path)
-                    Chroma.from_documents(text,
-                                          OpenAIEmbeddings(),
-                                          persist_directory=self._persist_dir,
-                                          collection_name=self._collection_name)
-                    Chroma.from_documents(text,
-                                          OpenAIEmbeddings(),
-                                          persist_directory=f'{self._persist_dir}/{file_name}',
-                                          collection_name=file_name)
-                    print(f"file: {file_name}")
-                    print("SUCCESS: ", file_path)
+                    documents = {}
+                    for document in self._get_text(file_path):
+                        documents[IngestionManifest.chunk_id(file_name, document.page_content)] = document
+                    added, removed = manifest.diff(file_name, {k: v.page_content for k, v in documents.items()})
                 except Exception as e:
                     print("FAILED: ", file_path + f"by({e})")
+                    continue
+                if not added and not removed:
+                    print("SKIP: ", file_path)
+                    continue
+                yield IngestionJob(file_name, file_path, documents, list(added.keys()), list(removed))
+
+    def push_texts(self, max_concurrency: int = 4) -> IngestionProgress:
+        self.migrate_layout()
+        manifest_path = os.path.join(self._persist_dir, "manifest.json")
+        if not os.path.exists(manifest_path) and self._store.count() > 0:
+            # chunks written before the manifest existed carry random ids that no diff can match, so start over
+            print("REBUILD: ", self._persist_dir)
+            self._store.delete_all()
+        manifest = IngestionManifest(manifest_path)
+        if self._store.count() == 0:
+            # e.g. a deployment switched vector store backends; the manifest describes the other store
+            for source in manifest.sources():
+                manifest.remove(source)
+        seen_sources = set()
 
-    def query_db(self, query: str, use_retriever: bool = False, collection_name: str = "") -> list[str]:
-        target_collection_name = collection_name if collection_name != "" else self._collection_name
-        persist_dir = f'{self._persist_dir}/{target_collection_name}' if collection_name != "" else self._persist_dir
+        def write_job(job: IngestionJob, embeddings: List[List[float]]) -> None:
+            added_documents = [job.documents[chunk_id] for chunk_id in job.added_ids]
+            self._write_chunks(job.added_ids, added_documents, embeddings, job.removed_ids)
+            manifest.update(job.source, {k: v.page_content for k, v in job.documents.items()})
+            manifest.save()
 
-        _db = Chroma(
-            persist_directory=persist_dir,
-            embedding_function=OpenAIEmbeddings(),
-            collection_name=target_collection_name,
+        pipeline = IngestionPipeline(
+            embed_fn=self._registry.embeddings.embed_documents,
+            write_fn=write_job,
+            max_concurrency=max_concurrency,
         )
-        _retriever = _db.as_retriever()
+        progress = pipeline.run(self._load_jobs(manifest, seen_sources))
 
-        if use_retriever:
-            docs = _retriever.get_relevant_documents(query)
-        else:
-            docs = _db.similarity_search(query)
+        for file_name in set(manifest.sources()) - seen_sources:
+            try:
+                removed_ids = list(manifest.chunk_ids(file_name))
+                self._write_chunks([], [], [], removed_ids)
+                manifest.remove(file_name)
+                manifest.save()
+                progress.chunks_removed += len(removed_ids)
+                print("REMOVED: ", file_name)
+            except Exception as e:
+                print("FAILED: ", file_name + f"by({e})")
+
+        if progress.chunks_added or progress.chunks_removed or not os.path.exists(self._lexical_index_path()):
+            self._build_lexical_index()
+        return progress
+
+    def _lexical_index_path(self) -> str:
+        return os.path.join(self._persist_dir, "lexical_index.json")
+
+    def _build_lexical_index(self) -> None:
+        result = self._store.get(include=("documents", "metadatas"))
+        documents = []
+        for chunk_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"]):
+            documents.append({"id": chunk_id, "text": text, "source": (metadata or {}).get("source", "")})
+        index = LexicalIndex()
+        index.build(documents)
+        index.save(self._lexical_index_path())
+        self._lexical_index = index
+        self._lexical_version = self.corpus_version()
+        print(f"lexical index: {len(index)} chunks")
+
+    def _get_lexical_index(self) -> LexicalIndex:
+        if self._lexical_index is None or self._lexical_version != self.corpus_version():
+            if not os.path.exists(self._lexical_index_path()):
+                return None
+            self._lexical_index = LexicalIndex.load(self._lexical_index_path())
+            self._lexical_version = self.corpus_version()
+        return self._lexical_index
+
+    def _is_confident(self, results: list) -> bool:
+        if not results:
+            return False
+        _, top_score, coverage = results[0]
+        if coverage < self._lexical_min_coverage:
+            return False
+        return len(results) == 1 or top_score >= results[1][1] * self._lexical_min_margin
+
+    def embed_query(self, query: str) -> List[float]:
+        return self._registry.embeddings.embed_query(query)
+
+    def collection_embeddings(self, collection_name: str) -> List[List[float]]:
+        result = self._store.get(where={"source": collection_name}, include=("embeddings",))
+        return result["embeddings"] or []
+
+    def query_db(self, query: str, use_retriever: bool = False, collection_name: Union[str, List[str]] = "",
+                 k: int = 4, search_mode: str = "hybrid") -> list[str]:
+        sources = self._sources(collection_name)
+        with tracer.span("vector", ",".join(sources) or self._collection_name, search_mode=search_mode) as span:
+            docs = self._query_db(query, use_retriever, sources, k, search_mode, span)
+            span.set(results=len(docs))
+            return docs
+
+    def _query_db(self, query: str, use_retriever: bool, sources: List[str], k: int, search_mode: str,
+                  span) -> list[str]:
+        lexical_docs = []
+        if search_mode in ("hybrid", "lexical"):
+            lexical_index = self._get_lexical_index()
+            if lexical_index is not None:
+                results = lexical_index.search(query, k=k, sources=sources)
+                lexical_docs = [document["text"] for document, _, _ in results]
+                confident = self._is_confident(results)
+                span.set(lexical_confident=confident)
+                if search_mode == "lexical" or confident:
+                    return lexical_docs
+        if search_mode == "lexical":
+            # never falls back to the vector search, which needs a query embedding from the API
+            return lexical_docs
+
+        # the retriever was a plain top-k similarity search, so both paths share the vector store query
+        str_docs = [text for text, _ in self._vector_search(query, sources, k)]
+
+        if not lexical_docs:
+            return str_docs
+        return reciprocal_rank_fusion([str_docs, lexical_docs])[:k]
+
+    def _vector_search(self, query: str, sources: List[str], k: int) -> List[Tuple[str, float]]:
+        if self._store.count() == 0:
+            return []
+        return [(hit["document"], hit["distance"]) for hit in self._fan_out(self.embed_query(query), sources, k, k)]
+
+    def _fan_out(self, embedding: List[float], sources: List[str], n_results: int, k: int) -> List[dict]:
+        # one query embedding, every source searched at once, merged by distance and deduped
+        use_mmr = self._mmr_lambda is not None
+        wheres = [{"source": source} for source in sources] or [None]
+        results = self._store.fan_out_query(embedding, wheres, n_results * 4 if use_mmr else n_results,
+                                            with_embeddings=use_mmr)
+        hits, seen = [], set()
+        for hit in sorted([hit for source_hits in results for hit in source_hits], key=lambda hit: hit["distance"]):
+            if hit["id"] in seen or hit["document"] in seen:
+                continue
+            seen.update((hit["id"], hit["document"]))
+            hits.append(hit)
+        if use_mmr:
+            selected = maximal_marginal_relevance(np.asarray(embedding, dtype=np.float32),
+                                                  np.asarray([hit["embedding"] for hit in hits], dtype=np.float32),
+                                                  k, self._mmr_lambda)
+            hits = [hits[i] for i in selected]
+        return hits[:k]
+
+    # chunks from every named source (all of them when empty), each tagged with where it came from
+    def query_sources(self, query: str, collection_names: Iterable[str] = (), k_per_source: int = 4,
+                      k: Optional[int] = None) -> List[dict]:
+        sources = self._sources(collection_names) or self.collection_names()
+        with tracer.span("vector", "fan_out", sources=len(sources)) as span:
+            if self._store.count() == 0:
+                return []
+            hits = self._fan_out(self.embed_query(query), sources, k_per_source,
+                                 k if k is not None else k_per_source * len(sources))
+            span.set(results=len(hits))
+            return [{
+                "source": (hit["metadata"] or {}).get("source", ""),
+                "section": (hit["metadata"] or {}).get("section", ""),
+                "text": hit["document"],
+                "distance": hit["distance"],
+            } for hit in hits]
+
+    async def aquery_sources(self, query: str, collection_names: Iterable[str] = (), k_per_source: int = 4,
+                             k: Optional[int] = None) -> List[dict]:
+        return await asyncio.to_thread(self.query_sources, query, list(collection_names), k_per_source, k)
 
-        str_docs = [doc.page_content for doc in docs]
-        return str_docs
+    async def aquery_db(self, query: str, use_retriever: bool = False, collection_name: Union[str, List[str]] = "",
+                        k: int = 4, search_mode: str = "hybrid") -> list[str]:
+        return await asyncio.to_thread(self.query_db, query, use_retriever, collection_name, k, search_mode)
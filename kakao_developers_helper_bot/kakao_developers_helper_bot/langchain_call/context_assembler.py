@@ -0,0 +1,101 @@
+from typing import Iterable, List, Tuple
+
+import tiktoken
+
+DEFAULT_BUDGETS = {
+    "information": 6000,
+    "search_result": 3000,
+    "related_web_search_results": 3000,
+    "action_history": 1000,
+    "retrieval_preview": 1000,
+    "chat_history": 2000,
+    "messages": 3000,
+}
+
+# sections whose most recent part matters; the others keep their beginning
+TAIL_SECTIONS = {"action_history", "chat_history", "information"}
+
+
+class ContextAssembler:
+    _budgets: dict[str, int]
+    _encoding: tiktoken.Encoding = None
+
+    def __init__(self, budgets: dict[str, int] = None) -> None:
+        self._budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+
+    def _get_encoding(self) -> tiktoken.Encoding:
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+        return self._encoding
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._get_encoding().encode(text))
+
+    def fit(self, section: str, text: str) -> str:
+        budget = self._budgets.get(section)
+        if budget is None:
+            return text
+        tokens = self._get_encoding().encode(text)
+        if len(tokens) <= budget:
+            return text
+        kept = tokens[-budget:] if section in TAIL_SECTIONS else tokens[:budget]
+        # decoded as bytes, so a character split across the cut is dropped instead of becoming U+FFFD
+        return self._get_encoding().decode_bytes(kept).decode("utf-8", errors="ignore")
+
+    # whole chunks that fit the budget; only a single chunk larger than the budget is cut
+    def fit_chunks(self, section: str, chunks: List[str]) -> str:
+        budget = self._budgets.get(section)
+        if budget is None:
+            return "\n\n".join(chunks)
+        separator_tokens = self.count_tokens("\n\n")
+        kept = []
+        for chunk in (reversed(chunks) if section in TAIL_SECTIONS else chunks):
+            budget -= self.count_tokens(chunk) + separator_tokens
+            if budget < 0:
+                break
+            kept.append(chunk)
+        if not kept:
+            return self.fit(section, "\n\n".join(chunks))
+        return "\n\n".join(reversed(kept) if section in TAIL_SECTIONS else kept)
+
+    @staticmethod
+    def _chunk_key(chunk: str) -> str:
+        return " ".join(chunk.split())
+
+    # drops chunks already used this turn; they only count as used once mark_seen is called
+    @classmethod
+    def dedupe(cls, chunks: Iterable[str], seen: set[str]) -> List[str]:
+        unique = {}
+        for chunk in chunks:
+            key = cls._chunk_key(chunk)
+            if key not in seen and key not in unique:
+                unique[key] = chunk
+        return list(unique.values())
+
+    @classmethod
+    def mark_seen(cls, chunks: Iterable[str], seen: set[str]) -> None:
+        seen.update(cls._chunk_key(chunk) for chunk in chunks)
+
+    def assemble(self, context: dict) -> dict:
+        inputs = {}
+        for key, value in context.items():
+            if isinstance(value, list):
+                inputs[key] = self.fit_chunks(key, value)
+            else:
+                inputs[key] = self.fit(key, value) if isinstance(value, str) else value
+        return inputs
+
+    # turns are (question, answer) pairs, oldest first; keeps the most recent turns that fit the budget
+    def fit_turns(self, turns: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        budget = self._budgets["messages"]
+        kept = []
+        for question, answer in reversed(turns):
+            budget -= self.count_tokens(question) + self.count_tokens(answer)
+            if budget < 0:
+                break
+            kept.append((question, answer))
+        return list(reversed(kept))
+
+    def count_inputs(self, inputs: dict, keys: Iterable[str]) -> int:
+        counts = {key: self.count_tokens(inputs[key]) for key in keys if isinstance(inputs.get(key), str)}
+        return sum(counts.values())
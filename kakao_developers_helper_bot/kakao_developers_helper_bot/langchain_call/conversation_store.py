@@ -0,0 +1,94 @@
+import glob
+import json
+import os
+import time
+from typing import List
+
+from langchain.schema import BaseChatMessageHistory, BaseMessage, messages_from_dict, messages_to_dict
+
+from llm_client.chat_history import ChatHistory
+
+
+# the chat UI's turns live next to the messages the agent reads, in the same database
+class ConversationStore(ChatHistory):
+    def __init__(self, db_path: str) -> None:
+        super().__init__(db_path)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "conversation_id TEXT NOT NULL, "
+                "message TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS messages_conversation_id ON messages (conversation_id, id)"
+            )
+
+    def append(self, conversation_id: str, messages: List[BaseMessage]) -> None:
+        now = time.time()
+        rows = [(conversation_id, json.dumps(message, ensure_ascii=False), now)
+                for message in messages_to_dict(messages)]
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT INTO messages (conversation_id, message, created_at) VALUES (?, ?, ?)", rows
+            )
+
+    def messages(self, conversation_id: str, limit: int = None) -> List[BaseMessage]:
+        if limit is None:
+            rows = self._connection().execute(
+                "SELECT message FROM messages WHERE conversation_id = ? ORDER BY id", (conversation_id,)
+            ).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT message FROM (SELECT id, message FROM messages WHERE conversation_id = ? "
+                "ORDER BY id DESC LIMIT ?) ORDER BY id", (conversation_id, limit)
+            ).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
+    def count(self, conversation_id: str) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()[0]
+
+    def clear(self, conversation_id: str) -> None:
+        with self._connection() as connection:
+            connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            connection.execute("DELETE FROM turns WHERE conversation_id = ?", (conversation_id,))
+
+    def migrate_json_history(self, history_dir: str) -> int:
+        migrated = 0
+        for file_path in glob.glob(os.path.join(history_dir, "*.json")):
+            conversation_id, _ = os.path.splitext(os.path.basename(file_path))
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    messages = messages_from_dict(json.load(f))
+                if self.count(conversation_id) == 0:
+                    self.append(conversation_id, messages)
+                os.replace(file_path, f"{file_path}.migrated")
+                migrated += 1
+                print("MIGRATED: ", file_path)
+            except Exception as e:
+                print("FAILED: ", file_path + f"by({e})")
+        return migrated
+
+
+class StoreChatMessageHistory(BaseChatMessageHistory):
+    _store: ConversationStore
+    _conversation_id: str
+    _window: int
+
+    def __init__(self, store: ConversationStore, conversation_id: str, window: int = None) -> None:
+        self._store = store
+        self._conversation_id = conversation_id
+        self._window = window
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self._store.messages(self._conversation_id, self._window)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self._store.append(self._conversation_id, [message])
+
+    def clear(self) -> None:
+        self._store.clear(self._conversation_id)
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    _cache_dir: str
+    _max_entries: int
+    _initial_capacity: int
+    _dim: int = 0
+    _capacity: int = 0
+    # key -> slot, least recently used first
+    _entries: "OrderedDict[str, int]"
+    _slots: dict[int, str]
+    _free: list[int]
+    _next_slot: int = 0
+    _log_lines: int = 0
+    _vectors: np.memmap = None
+    _lock: threading.Lock
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self, cache_dir: str, max_entries: int = 50000, initial_capacity: int = 1024) -> None:
+        self._cache_dir = cache_dir
+        self._max_entries = max_entries
+        self._initial_capacity = min(initial_capacity, max_entries)
+        self._entries = OrderedDict()
+        self._slots = {}
+        self._free = []
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(self._log_path()) and os.path.exists(self._vectors_path()):
+            self._replay()
+
+    def _log_path(self) -> str:
+        return os.path.join(self._cache_dir, "index.log")
+
+    def _vectors_path(self) -> str:
+        return os.path.join(self._cache_dir, "vectors.f32")
+
+    # the index is an append-only log of [key, slot] lines, [key, null] once a key is evicted
+    def _replay(self) -> None:
+        with open(self._log_path(), "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        if not lines:
+            return
+        header = json.loads(lines[0])
+        if header.get("max_entries") != self._max_entries:
+            return
+        self._dim = header["dim"]
+        capacity = os.path.getsize(self._vectors_path()) // (4 * self._dim)
+        for line in lines[1:]:
+            try:
+                key, slot = json.loads(line)
+            except ValueError:
+                # a line torn by a crash mid-append; everything before it is intact
+                break
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                del self._slots[previous]
+            if slot is not None and slot < capacity:
+                self._entries.pop(self._slots.get(slot), None)
+                self._entries[key] = slot
+                self._slots[slot] = key
+        self._next_slot = max(self._slots, default=-1) + 1
+        self._free = [slot for slot in range(self._next_slot) if slot not in self._slots]
+        self._log_lines = len(lines) - 1
+        self._capacity = capacity
+        self._vectors = np.memmap(self._vectors_path(), dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+        return hashlib.sha256(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.key(model, text)
+                slot = self._entries.get(key)
+                if slot is None or self._vectors is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._entries.move_to_end(key)
+                results.append(self._vectors[slot].tolist())
+        return results
+
+    def put(self, model: str, texts: List[str], embeddings: List[List[float]]) -> None:
+        if not texts:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._dim = len(embeddings[0])
+                self._resize(self._initial_capacity, reset=True)
+                self._rewrite_log()
+            evicted, added = [], []
+            for text, embedding in zip(texts, embeddings):
+                key = self.key(model, text)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    continue
+                slot = self._allocate_slot(evicted)
+                self._entries[key] = slot
+                self._slots[slot] = key
+                added.append((key, slot, embedding))
+            # an evicted key is logged gone before its slot is overwritten, and a new key only once its vector is
+            self._append_log([(key, None) for key in evicted])
+            for _, slot, embedding in added:
+                self._vectors[slot] = np.asarray(embedding, dtype=np.float32)
+            self._vectors.flush()
+            self._append_log([(key, slot) for key, slot, _ in added])
+            if self._log_lines > 2 * max(len(self._entries), self._initial_capacity):
+                self._rewrite_log()
+
+    def _allocate_slot(self, evicted: list[str]) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._next_slot < self._max_entries:
+            if self._next_slot >= self._capacity:
+                self._resize(min(self._capacity * 2, self._max_entries))
+            self._next_slot += 1
+            return self._next_slot - 1
+        evicted_key, slot = self._entries.popitem(last=False)
+        del self._slots[slot]
+        evicted.append(evicted_key)
+        return slot
+
+    # the vector file starts small and doubles up to max_entries rows
+    def _resize(self, capacity: int, reset: bool = False) -> None:
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path(), "wb" if reset else "r+b") as f:
+            f.truncate(capacity * self._dim * 4)
+        self._capacity = capacity
+        self._vectors = np.memmap(self._vectors_path(), dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+
+    def _append_log(self, records: list[tuple[str, Optional[int]]]) -> None:
+        if not records:
+            return
+        with open(self._log_path(), "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        self._log_lines += len(records)
+
+    # drops superseded lines; entries are written least recently used first so a reload keeps the order
+    def _rewrite_log(self) -> None:
+        tmp_path = f"{self._log_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"dim": self._dim, "max_entries": self._max_entries}) + "\n")
+            f.writelines(json.dumps([key, slot]) + "\n" for key, slot in self._entries.items())
+        os.replace(tmp_path, self._log_path())
+        self._log_lines = len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class CachedEmbeddings(Embeddings):
+    _embeddings: Embeddings
+    _cache: EmbeddingCache
+    _model: str
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache) -> None:
+        self._embeddings = embeddings
+        self._cache = cache
+        self._model = getattr(embeddings, "model", embeddings.__class__.__name__)
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results = self._cache.get(self._model, texts)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            embeddings = self._embeddings.embed_documents(missing_texts)
+            self._cache.put(self._model, missing_texts, embeddings)
+            for i, embedding in zip(missing, embeddings):
+                results[i] = embedding
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        result = self._cache.get(self._model, [text])[0]
+        if result is None:
+            result = self._embeddings.embed_query(text)
+            self._cache.put(self._model, [text], [result])
+        return result
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import os
+
+
+class IngestionManifest:
+    _manifest_path: str
+    _sources: dict[str, list[str]]
+
+    def __init__(self, manifest_path: str) -> None:
+        self._manifest_path = manifest_path
+        self._sources = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self._sources = json.load(f).get("sources", {})
+
+    @staticmethod
+    def chunk_id(source: str, content: str) -> str:
+        return hashlib.sha256(f"{source}\0{content}".encode("utf-8")).hexdigest()
+
+    def sources(self) -> list[str]:
+        return list(self._sources.keys())
+
+    def chunk_ids(self, source: str) -> set[str]:
+        return set(self._sources.get(source, []))
+
+    def diff(self, source: str, chunks: dict[str, str]) -> tuple[dict[str, str], set[str]]:
+        known = self.chunk_ids(source)
+        added = {chunk_id: content for chunk_id, content in chunks.items() if chunk_id not in known}
+        removed = known - set(chunks.keys())
+        return added, removed
+
+    def update(self, source: str, chunks: dict[str, str]) -> None:
+        self._sources[source] = sorted(chunks.keys())
+
+    def remove(self, source: str) -> None:
+        self._sources.pop(source, None)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self._manifest_path), exist_ok=True)
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sources": self._sources}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._manifest_path)
@@ -0,0 +1,114 @@
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, List
+
+import tiktoken
+from langchain.schema import Document
+
+
+class IngestionJob:
+    source: str
+    file_path: str
+    documents: dict[str, Document]
+    added_ids: list[str]
+    removed_ids: list[str]
+
+    def __init__(self, source: str, file_path: str, documents: dict[str, Document], added_ids: list[str],
+                 removed_ids: list[str]) -> None:
+        self.source = source
+        self.file_path = file_path
+        self.documents = documents
+        self.added_ids = added_ids
+        self.removed_ids = removed_ids
+
+    def added_texts(self) -> list[str]:
+        return [self.documents[chunk_id].page_content for chunk_id in self.added_ids]
+
+
+class IngestionProgress:
+    files: int = 0
+    failed_files: int = 0
+    chunks_added: int = 0
+    chunks_removed: int = 0
+    tokens: int = 0
+    _started_at: float
+
+    def __init__(self) -> None:
+        self._started_at = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started_at
+
+    def report(self, message: str = "") -> None:
+        elapsed = self.elapsed()
+        throughput = self.chunks_added / elapsed if elapsed > 0 else 0.0
+        print(f"ingest: {self.files} files ({self.failed_files} failed), +{self.chunks_added} -{self.chunks_removed} "
+              f"chunks, {self.tokens} tokens, {elapsed:.1f}s, {throughput:.1f} chunks/s {message}".rstrip())
+
+
+class IngestionPipeline:
+    _embed_fn: Callable[[List[str]], List[List[float]]]
+    _write_fn: Callable[[IngestionJob, List[List[float]]], None]
+    _max_batch_tokens: int
+    _max_batch_size: int
+    _max_concurrency: int
+    _encoding: tiktoken.Encoding = None
+
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]],
+                 write_fn: Callable[[IngestionJob, List[List[float]]], None],
+                 max_batch_tokens: int = 8000, max_batch_size: int = 256, max_concurrency: int = 4) -> None:
+        self._embed_fn = embed_fn
+        self._write_fn = write_fn
+        self._max_batch_tokens = max_batch_tokens
+        self._max_batch_size = max_batch_size
+        self._max_concurrency = max_concurrency
+
+    def _count_tokens(self, text: str) -> int:
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+        return len(self._encoding.encode(text))
+
+    def _batches(self, texts: list[str]) -> Iterable[tuple[list[str], int]]:
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = self._count_tokens(text)
+            if batch and (batch_tokens + tokens > self._max_batch_tokens or len(batch) >= self._max_batch_size):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch, batch_tokens
+
+    def _write(self, job: IngestionJob, futures: list[tuple[Future, int]], progress: IngestionProgress) -> None:
+        try:
+            embeddings = []
+            for future, tokens in futures:
+                embeddings.extend(future.result())
+                progress.tokens += tokens
+            self._write_fn(job, embeddings)
+            progress.files += 1
+            progress.chunks_added += len(job.added_ids)
+            progress.chunks_removed += len(job.removed_ids)
+            progress.report(f"[{job.source}]")
+        except Exception as e:
+            progress.failed_files += 1
+            print("FAILED: ", job.file_path + f"by({e})")
+
+    def run(self, jobs: Iterable[IngestionJob]) -> IngestionProgress:
+        progress = IngestionProgress()
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+            for job in jobs:
+                # embed_fn goes through the llm gateway, which already retries and fails fast once its breaker opens
+                futures = [(executor.submit(self._embed_fn, batch), tokens)
+                           for batch, tokens in self._batches(job.added_texts())]
+                pending.append((job, futures))
+                while pending and (len(pending) > self._max_concurrency
+                                   or all(future.done() for future, _ in pending[0][1])):
+                    self._write(*pending.popleft(), progress)
+            while pending:
+                self._write(*pending.popleft(), progress)
+        progress.report("done")
+        return progress
@@ -1,169 +1,459 @@
+import asyncio
 import os
+import time
+from typing import AsyncIterator, Callable, List, Optional
 
+import numpy as np
 from langchain import LLMChain, GoogleSearchAPIWrapper
+from langchain.callbacks import AsyncIteratorCallbackHandler
 from langchain.chat_models import ChatOpenAI
-from langchain.memory import FileChatMessageHistory, ConversationBufferMemory
-from langchain.prompts import ChatPromptTemplate
+from langchain.chat_models.base import BaseChatModel
+from langchain.memory import ConversationBufferMemory
 from langchain.tools import Tool
+from llm_client.client import LlmClient
+from llm_client.prompt_template import create_chain, read_prompt_template
 
 from kakao_developers_helper_bot.langchain_call.chroma_db_repository import ChromaDbRepository
+from kakao_developers_helper_bot.langchain_call.context_assembler import ContextAssembler
+from kakao_developers_helper_bot.langchain_call.conversation_store import ConversationStore, StoreChatMessageHistory
+from kakao_developers_helper_bot.langchain_call.llm_gateway import LlmUnavailableError, llm_gateway
+from kakao_developers_helper_bot.langchain_call.local_router import LocalRouter
+from kakao_developers_helper_bot.langchain_call.search_cache import SearchCache
+from kakao_developers_helper_bot.langchain_call.semantic_answer_cache import SemanticAnswerCache
+from kakao_developers_helper_bot.langchain_call.speculative_retrieval import SpeculativeRetrieval
+from kakao_developers_helper_bot.langchain_call.tracing import tracer
+from kakao_developers_helper_bot.langchain_call.turn_budget import TurnBudget
 
 class LangChainAssistant:
     _history_dir: str
+    _conversation_store: ConversationStore
+    _history_window: int
+    _context_assembler: ContextAssembler
+    _router: LocalRouter
     _job_list_text: str
     _vector_db: ChromaDbRepository
     _parse_job_chain: LLMChain
+    _speculative_web_search: bool
+    _answer_cache: SemanticAnswerCache
+    _verbose: bool
+    _search_func: Callable[[str], str]
+    _search_tool: Tool
+    _search_cache: SearchCache
+    _turn_budget: TurnBudget
+    _llm_client: LlmClient
 
-    def __init__(self, history_dir: str, template_dir: str, vector_db: ChromaDbRepository) -> None:
+    def __init__(self, history_dir: str, template_dir: str, vector_db: ChromaDbRepository,
+                 speculative_web_search: bool = False, answer_cache: SemanticAnswerCache = None,
+                 history_window: int = 20, router: LocalRouter = None, llm: BaseChatModel = None,
+                 streaming_llm: BaseChatModel = None, search_func: Callable[[str], str] = None,
+                 verbose: bool = False, search_cache: SearchCache = None,
+                 conversation_store: ConversationStore = None, turn_budget: TurnBudget = None,
+                 llm_client: LlmClient = None) -> None:
         self._history_dir = history_dir
+        self._search_cache = search_cache if search_cache is not None \
+            else SearchCache(os.path.join(history_dir, "search_cache.db"))
+        self._verbose = verbose
+        self._turn_budget = turn_budget if turn_budget is not None else TurnBudget()
+        self._llm_client = llm_client if llm_client is not None else LlmClient()
+        self._router = router
+        self._conversation_store = conversation_store if conversation_store is not None \
+            else ConversationStore(os.path.join(history_dir, "conversations.db"))
+        self._conversation_store.migrate_json_history(history_dir)
+        self._history_window = history_window
+        self._context_assembler = ContextAssembler()
+        self._answer_cache = answer_cache
+        self._speculative_web_search = speculative_web_search
         self._job_list_text = os.path.join(template_dir, "job_list.txt")
         self._vector_db = vector_db
-        llm = ChatOpenAI(temperature=0.1, max_tokens=4096, model="gpt-3.5-turbo-16k")
+        # retries are owned by llm_gateway, a single attempt here keeps 429 storms from multiplying
+        if llm is None:
+            llm = ChatOpenAI(temperature=0.1, max_tokens=4096, model="gpt-3.5-turbo-16k", max_retries=1,
+                             request_timeout=self._llm_client.request_timeout)
+        if streaming_llm is None:
+            streaming_llm = ChatOpenAI(temperature=0.1, max_tokens=4096, model="gpt-3.5-turbo-16k", streaming=True,
+                                       max_retries=1, request_timeout=self._llm_client.stream_timeout)
 
-        search = GoogleSearchAPIWrapper(
-            google_api_key=os.environ['GOOGLE_API_KEY'],
-            google_cse_id=os.environ['GOOGLE_CSE_ID']
-        )
-
-        self.search_tool = Tool(
-            name="Google Search",
-            description="Search Google for recent results.",
-            func=search.run,
-        )
-        self._parse_job_chain = self.create_chain(
+        self._search_func = search_func
+        self._search_tool = None
+        self._parse_job_chain = create_chain(
             llm=llm,
             template_path=os.path.join(template_dir, "parse_job.txt"),
             output_key="job",
+            verbose=self._verbose,
         )
-        self._select_wiki_page_chain = self.create_chain(
+        self._select_wiki_page_chain = create_chain(
             llm=llm,
             template_path=os.path.join(template_dir, "select_wiki_page.txt"),
             output_key="collection_name",
+            verbose=self._verbose,
         )
-        self._evaluate_check_chain = self.create_chain(
+        self._evaluate_check_chain = create_chain(
             llm=llm,
             template_path=os.path.join(template_dir, "evaluate_check.txt"),
             output_key="evaluate_check",
+            verbose=self._verbose,
         )
-        self._information_chain = self.create_chain(
-            llm=llm,
+        self._information_chain = create_chain(
+            llm=streaming_llm,
             template_path=os.path.join(template_dir, "information_response.txt"),
             output_key="answer",
+            verbose=self._verbose,
         )
-        self.search_value_check_chain = self.create_chain(
+        self.search_value_check_chain = create_chain(
             llm=llm,
             template_path=os.path.join(template_dir, "search_value_check.txt"),
             output_key="output",
+            verbose=self._verbose,
         )
-        self.search_compression_chain = self.create_chain(
+        self.search_compression_chain = create_chain(
             llm=llm,
             template_path=os.path.join(template_dir, "search_compress.txt"),
             output_key="output",
+            verbose=self._verbose,
         )
 
-    def read_prompt_template(self, file_path: str) -> str:
-        with open(file_path, "r") as f:
-            prompt_template = f.read()
+    @property
+    def search_tool(self) -> Tool:
+        if self._search_tool is None:
+            search_func = self._search_func
+            if search_func is None:
+                search_func = GoogleSearchAPIWrapper(
+                    google_api_key=os.environ['GOOGLE_API_KEY'],
+                    google_cse_id=os.environ['GOOGLE_CSE_ID']
+                ).run
+            self._search_tool = Tool(
+                name="Google Search",
+                description="Search Google for recent results.",
+                func=search_func,
+            )
+        return self._search_tool
 
-        return prompt_template
+    def load_conversation_history(self, conversation_id: str) -> StoreChatMessageHistory:
+        return StoreChatMessageHistory(self._conversation_store, conversation_id, self._history_window)
 
-    def create_chain(self, llm, template_path, output_key) -> LLMChain:
-        return LLMChain(
-            llm=llm,
-            prompt=ChatPromptTemplate.from_template(
-                template=self.read_prompt_template(template_path)
-            ),
-            output_key=output_key,
-            verbose=True,
-        )
+    def get_chat_history(self, conversation_id: str):
+        with tracer.span("history", "get_chat_history", conversation_id=conversation_id) as span:
+            history = self.load_conversation_history(conversation_id)
+            memory = ConversationBufferMemory(
+                memory_key="chat_history",
+                input_key="user_message",
+                chat_memory=history,
+            )
+            buffer = memory.buffer
+            span.set(messages=len(memory.chat_memory.messages))
 
-    def load_conversation_history(self, conversation_id: str) -> FileChatMessageHistory:
-        file_path = os.path.join(self._history_dir, f"{conversation_id}.json")
-        return FileChatMessageHistory(file_path)
+        return buffer
 
-    def get_chat_history(self, conversation_id: str):
-        history = self.load_conversation_history(conversation_id)
-        memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            input_key="user_message",
-            chat_memory=history,
-        )
+    async def aget_chat_history(self, conversation_id: str):
+        return await asyncio.to_thread(self.get_chat_history, conversation_id)
 
-        return memory.buffer
+    async def asearch(self, query: str) -> str:
+        with tracer.span("web_search", "google") as span:
+            result, cache_hit = await self._search_cache.aget_or_fetch_with_status(
+                "raw", query, lambda: asyncio.to_thread(self.search_tool.run, query))
+            span.set(cache_hit=cache_hit)
+            return result
 
     def query_web_search(self, user_message: str) -> str:
-        context = {"user_message": user_message, "related_web_search_results": self.search_tool.run(user_message)}
+        return self._llm_client.run(self.aquery_web_search(user_message))
+
+    async def aquery_web_search(self, user_message: str) -> str:
+        return await self._search_cache.aget_or_fetch(
+            "compressed", user_message, lambda: self._acompress_web_search(user_message))
 
-        has_value = self.search_value_check_chain.run(context)
+    async def _acompress_web_search(self, user_message: str) -> str:
+        context = {"user_message": user_message, "related_web_search_results": await self.asearch(user_message)}
+
+        has_value = await self._arun_chain(self.search_value_check_chain, context)
 
-        print(has_value)
         if has_value == "Y":
-            return self.search_compression_chain.run(context)
+            return await self._arun_chain(self.search_compression_chain, context)
         else:
             return ""
 
-    def log_user_message(self, history: FileChatMessageHistory, user_message: str):
+    async def _arun_pooled(self, chain: LLMChain, inputs: dict, **kwargs) -> str:
+        # ChatOpenAI goes through openai.ChatCompletion, so it shares the client's keep-alive connections
+        async with self._llm_client.pooled():
+            return await chain.arun(inputs, **kwargs)
+
+    async def _arun_chain(self, chain: LLMChain, context: dict, **kwargs) -> str:
+        with tracer.span("chain", chain.output_key) as span:
+            inputs = self._context_assembler.assemble(context)
+            prompt_tokens = self._context_assembler.count_inputs(inputs, chain.prompt.input_variables)
+            # openai counts max_tokens against the tokens-per-minute limit, so reserve it up front
+            reserved_tokens = prompt_tokens + (getattr(chain.llm, "max_tokens", None) or 0)
+            # a streamed chain may already have emitted tokens, so it is never retried
+            started_at = time.perf_counter()
+            output = await llm_gateway.acall(lambda: self._arun_pooled(chain, inputs, **kwargs), reserved_tokens,
+                                             max_retries=0 if "callbacks" in kwargs else None)
+            completion_tokens = self._context_assembler.count_tokens(output)
+            self._llm_client.record(getattr(chain.llm, "model_name", ""), (time.perf_counter() - started_at) * 1000,
+                                    prompt_tokens, completion_tokens)
+            span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            budget = TurnBudget.current()
+            if budget is not None:
+                budget.record_llm_call(prompt_tokens, completion_tokens)
+            if chain.output_key == "job":
+                span.set(job=output)
+            return output
+
+    def log_user_message(self, history: StoreChatMessageHistory, user_message: str):
         history.add_user_message(user_message)
 
-    def log_bot_message(self, history: FileChatMessageHistory, bot_message: str):
+    def log_bot_message(self, history: StoreChatMessageHistory, bot_message: str):
         history.add_ai_message(bot_message)
 
     def generate_answer(self, user_message, conversation_id: str = 'fa1010') -> str:
+        return self._llm_client.run(self.agenerate_answer(user_message, conversation_id))
+
+    async def _alookup_answer(self, user_message: str, use_cache: bool) -> Optional[str]:
+        if self._answer_cache is None or not use_cache:
+            return None
+        with tracer.span("cache", "answer_cache") as span:
+            try:
+                answer = await self._answer_cache.alookup(user_message, "lang_chain_call")
+            except LlmUnavailableError:
+                # the lookup embeds the question; with the breaker open that is just a miss
+                answer = None
+            span.set(cache_hit=answer is not None)
+        return answer
+
+    async def _astore_answer(self, context: dict, answer: str, use_cache: bool) -> None:
+        # answers that depend on the conversation history are not reusable by other conversations
+        if self._answer_cache is None or not use_cache or context["chat_history"]:
+            return
+        try:
+            await self._answer_cache.astore(context["user_message"], answer, "lang_chain_call")
+        except LlmUnavailableError:
+            pass
+
+    async def _adegraded_answer(self, user_message: str, error: LlmUnavailableError) -> str:
+        # lexical only: the vector search and the answer cache both need the API that just failed
+        with tracer.span("degraded", "retrieval_only", reason=str(error)):
+            chunks = await self._vector_db.aquery_db(user_message, search_mode="lexical")
+        return "답변 생성이 지연되고 있어 관련 문서를 먼저 보여드립니다.\n\n" + "\n\n".join(chunks)
+
+    async def agenerate_answer(self, user_message, conversation_id: str = 'fa1010', use_cache: bool = True) -> str:
+        with tracer.turn(conversation_id):
+            history_file = self.load_conversation_history(conversation_id)
+            answer = await self._alookup_answer(user_message, use_cache)
+            if answer is None:
+                try:
+                    context = await self._acollect_information(user_message, conversation_id)
+                    answer = await self._arun_chain(self._information_chain, context)
+                    await self._astore_answer(context, answer, use_cache)
+                except LlmUnavailableError as e:
+                    answer = await self._adegraded_answer(user_message, e)
+
+            await asyncio.to_thread(self.log_user_message, history_file, user_message)
+            await asyncio.to_thread(self.log_bot_message, history_file, answer)
+            return answer
+
+    async def astream_answer(self, user_message, conversation_id: str = 'fa1010',
+                             use_cache: bool = True) -> AsyncIterator[str]:
+        with tracer.turn(conversation_id):
+            async for token in self._astream_answer(user_message, conversation_id, use_cache):
+                yield token
+
+    async def _astream_answer(self, user_message, conversation_id: str, use_cache: bool) -> AsyncIterator[str]:
         history_file = self.load_conversation_history(conversation_id)
+        cached_answer = await self._alookup_answer(user_message, use_cache)
+        if cached_answer is not None:
+            yield cached_answer
+            await asyncio.to_thread(self.log_user_message, history_file, user_message)
+            await asyncio.to_thread(self.log_bot_message, history_file, cached_answer)
+            return
+
+        try:
+            context = await self._acollect_information(user_message, conversation_id)
+
+            handler = AsyncIteratorCallbackHandler()
+            task = asyncio.create_task(self._arun_chain(self._information_chain, context, callbacks=[handler]))
+            task.add_done_callback(lambda _: handler.done.set())
+            async for token in handler.aiter():
+                yield token
+            answer = await task
+            await self._astore_answer(context, answer, use_cache)
+        except LlmUnavailableError as e:
+            answer = await self._adegraded_answer(user_message, e)
+            yield answer
 
+        await asyncio.to_thread(self.log_user_message, history_file, user_message)
+        await asyncio.to_thread(self.log_bot_message, history_file, answer)
+
+    async def _acollect_information(self, user_message, conversation_id: str) -> dict:
         context = dict(user_message=user_message)
         action_count = 1
-        context["job_list"] = self.read_prompt_template(self._job_list_text)
+        context["job_list"] = read_prompt_template(self._job_list_text)
         context["action_history"] = ""
         context["chat_history"] = ""
         context["information"] = ""
-        answer = ""
-
-        while True:
-            job = self._parse_job_chain.run(context)
-            print(f"job: {job}")
-            if job == "search_kakao_wiki" and action_count < 30:
-                context["action_history"] = f'{context["action_history"]}\n{action_count}. 생각: 카카오 위키 페이지를 열람 해야겠다'
-                action_count += 1
-                wiki_page = self._select_wiki_page_chain.run(context)
-                print(f'wiki_page: {wiki_page}')
-                context["action_history"] = f'{context["action_history"]}\n{action_count}. 생각: 카카오 위키 중 {wiki_page}를 열람 해야겠다'
-                action_count += 1
-                context["search_result"] = self._vector_db.query_db(context["user_message"], collection_name=wiki_page)
-                context["action_history"] = f'{context["action_history"]}\n{action_count}. 행동: {wiki_page}를 열람 했다'
-                action_count += 1
-                y_or_n = self._evaluate_check_chain.run(context)
-                if y_or_n == "Y" or y_or_n == "y":
-                    context["information"] = f'{context["information"]}\n카카오 위키: {wiki_page} 정보\n{context["search_result"]}'
-                    context["action_history"] = f'{context["action_history"]}\n{action_count}. 판단: {wiki_page}를 정보는 사용자 질문을 대답하기에 적절하다'
-                else:
-                    context["action_history"] = f'{context["action_history"]}\n{action_count}. 판단: {wiki_page}를 정보는 사용자 질문을 대답하기에 적절하지 않다'
-                action_count += 1
-            elif job == "history" and action_count < 30:
-                context["action_history"] = f'{context["action_history"]}\n{action_count}. 생각: 사용자의 이전 질문을 열람 해야겠다'
-                action_count += 1
-                chat_history = self.get_chat_history(conversation_id)
-                context["action_history"] = f'{context["action_history"]}\n{action_count}. 행동: 사용자의 이전 질문을 열람 했다'
-                action_count += 1
-                context["chat_history"] = chat_history
-            elif job == "search_internet" and action_count < 30:
-                context["action_history"] = f'{context["action_history"]}\n{action_count}. 생각: 인터넷에서 검색 해야겠다'
-                action_count += 1
-                context["search_result"] = self.search_tool.run(user_message)
-                context["action_history"] = f'{context["action_history"]}\n{action_count}. 행동: 인터넷에서 검색해서 자료를 획득했다'
-                action_count += 1
-                y_or_n = self._evaluate_check_chain.run(context)
-                if y_or_n == "Y" or y_or_n == "y":
-                    context["information"] = f'{context["information"]}\n인터넷 검색 자료: {wiki_page} 정보\n{context["search_result"]}'
-                    context["action_history"] = f'{context["action_history"]}\n{action_count}. 판단: 인터넷 정보는 사용자 질문을 대답하기에 적절하다'
-                else:
-                    context["action_history"] = f'{context["action_history"]}\n{action_count}. 판단: 인터넷 정보는 사용자 질문을 대답하기에 적절하지 않다'
-                action_count += 1
-            else:
-                answer = self._information_chain.run(context)
-                break
+        context["retrieval_preview"] = ""
+        seen_chunks = set()
+        visited_pages = set()
 
-        print(context["action_history"])
-        self.log_user_message(history_file, user_message)
-        self.log_bot_message(history_file, answer)
-        return answer
+        speculation = SpeculativeRetrieval()
+        for collection_name in self._vector_db.collection_names():
+            speculation.prefetch(f"wiki:{collection_name}",
+                                 lambda name=collection_name: self._vector_db.aquery_db(user_message, collection_name=name))
+        speculation.prefetch("history", lambda: self.aget_chat_history(conversation_id))
+        if self._speculative_web_search:
+            speculation.prefetch("internet", lambda: self.asearch(user_message))
+
+        budget = self._turn_budget.start()
+        budget_token = budget.activate()
+        fetched_jobs = set()
+        stop_reason = None
+        # one query embedding per turn serves every local routing decision
+        query_embedding = await asyncio.to_thread(self._router.embed, user_message) \
+            if self._router is not None else None
+        try:
+            while True:
+                stop_reason = budget.stop_reason(context, action_count)
+                if stop_reason is not None:
+                    break
+                try:
+                    action_count = await asyncio.wait_for(
+                        self._astep(context, action_count, speculation, conversation_id, seen_chunks, visited_pages,
+                                    fetched_jobs, query_embedding),
+                        timeout=budget.remaining_seconds())
+                except asyncio.TimeoutError:
+                    stop_reason = "time"
+                    break
+                if action_count is None:
+                    stop_reason = "response"
+                    break
+        finally:
+            with tracer.span("budget", stop_reason or "error", llm_calls=budget.llm_calls, tokens=budget.tokens):
+                TurnBudget.deactivate(budget_token)
+            with tracer.span("speculation", "prefetch", prefetch_hits=speculation.hits,
+                             prefetch_misses=speculation.misses):
+                speculation.cancel()
+
+        return context
+
+    async def _astep(self, context: dict, action_count: int, speculation: SpeculativeRetrieval, conversation_id: str,
+                     seen_chunks: set[str], visited_pages: set[str], fetched_jobs: set[str],
+                     query_embedding: Optional[np.ndarray] = None) -> Optional[int]:
+        # parse_job never waits on the prefetched searches; it sees whichever of them have already finished
+        if not context["retrieval_preview"]:
+            context["retrieval_preview"] = self._retrieval_preview(speculation)
+        job = await self._aroute_job(context, visited_pages, fetched_jobs, query_embedding)
+        # a page, the history or the web search is fetched at most once per turn
+        if job in fetched_jobs or (job == "search_kakao_wiki"
+                                   and visited_pages.issuperset(self._vector_db.collection_names())):
+            job = "response"
+        if job in ("history", "search_internet"):
+            fetched_jobs.add(job)
+        return await self._run_job(job, context, action_count, speculation, conversation_id, seen_chunks,
+                                   visited_pages, query_embedding)
+
+    def _retrieval_preview(self, speculation: SpeculativeRetrieval) -> str:
+        previews = []
+        for name in self._vector_db.collection_names():
+            chunks = speculation.peek(f"wiki:{name}")
+            if chunks:
+                previews.append(f"{name}: {' '.join(chunks[0].split())[:200]}")
+        return "\n".join(previews)
+
+    def _wiki_pages(self, wiki_page: str) -> List[str]:
+        # the page selection may name several pages, comma separated, for a question spanning products
+        names = self._vector_db.collection_names()
+        pages = [page.strip() for page in wiki_page.split(",") if page.strip() in names]
+        # an unknown page name falls back to searching every page rather than a collection that does not exist
+        return list(dict.fromkeys(pages)) or names
+
+    def _unvisited_page(self, wiki_page: str, visited_pages: set[str]) -> str:
+        wiki_pages = [page for page in self._wiki_pages(wiki_page) if page not in visited_pages]
+        if wiki_pages:
+            return ",".join(wiki_pages)
+        return next(name for name in self._vector_db.collection_names() if name not in visited_pages)
+
+    async def _aroute_wiki_page(self, context: dict, visited_pages: set[str],
+                                query_embedding: Optional[np.ndarray] = None) -> str:
+        if self._router is not None:
+            wiki_page, confidence = await asyncio.to_thread(
+                self._router.route_wiki_page, context["user_message"], visited_pages, query_embedding)
+            if wiki_page is not None:
+                self._router.log("wiki_page", context["user_message"], wiki_page, confidence, "local")
+                return wiki_page
+
+        wiki_page = await self._arun_chain(self._select_wiki_page_chain, context)
+        if self._router is not None:
+            self._router.log("wiki_page", context["user_message"], wiki_page, 0.0, "llm")
+        return wiki_page
+
+    async def _aroute_job(self, context: dict, visited_pages: set[str], fetched_jobs: set[str],
+                          query_embedding: Optional[np.ndarray] = None) -> str:
+        if self._router is not None:
+            job, confidence = await asyncio.to_thread(self._router.route_job, context, visited_pages, fetched_jobs,
+                                                      query_embedding)
+            if job is not None:
+                self._router.log("job", context["user_message"], job, confidence, "local")
+                return job
+
+        job = await self._arun_chain(self._parse_job_chain, context)
+        if self._router is not None:
+            self._router.log("job", context["user_message"], job, 0.0, "llm")
+        return job
+
+    async def _run_job(self, job: str, context: dict, action_count: int, speculation: SpeculativeRetrieval,
+                       conversation_id: str, seen_chunks: set[str], visited_pages: set[str],
+                       query_embedding: Optional[np.ndarray] = None) -> Optional[int]:
+        user_message = context["user_message"]
+        wiki_page = context.get("wiki_page", "")
+        if job == "search_kakao_wiki":
+            context["action_history"] = f'{context["action_history"]}\n{action_count}. 생각: 카카오 위키 페이지를 열람 해야겠다'
+            action_count += 1
+            # the page selection runs only once the job is known to need it
+            wiki_page = await self._aroute_wiki_page(context, visited_pages, query_embedding)
+            wiki_pages = self._wiki_pages(self._unvisited_page(wiki_page, visited_pages))
+            wiki_page = ",".join(wiki_pages)
+            context["wiki_page"] = wiki_page
+            visited_pages.update(wiki_pages)
+            if len(wiki_pages) > 1:
+                # the pages are searched together below, so their single-page prefetches will never be read
+                for page in wiki_pages:
+                    speculation.discard(f"wiki:{page}")
+            context["action_history"] = f'{context["action_history"]}\n{action_count}. 생각: 카카오 위키 중 {wiki_page}를 열람 해야겠다'
+            action_count += 1
+            # several selected pages share one query embedding and the same hybrid search, so this stays a single step
+            search_result = await speculation.get(
+                f"wiki:{wiki_page}",
+                lambda: self._vector_db.aquery_db(user_message, collection_name=wiki_pages, k=4 * len(wiki_pages)))
+            context["search_result"] = self._context_assembler.dedupe(search_result, seen_chunks)
+            context["action_history"] = f'{context["action_history"]}\n{action_count}. 행동: {wiki_page}를 열람 했다'
+            action_count += 1
+            y_or_n = await self._arun_chain(self._evaluate_check_chain, context)
+            if y_or_n == "Y" or y_or_n == "y":
+                # chunks a rejected page returned may still be useful to a later page
+                self._context_assembler.mark_seen(context["search_result"], seen_chunks)
+                search_result = "\n".join(context["search_result"])
+                context["information"] = f'{context["information"]}\n카카오 위키: {wiki_page} 정보\n{search_result}'
+                context["action_history"] = f'{context["action_history"]}\n{action_count}. 판단: {wiki_page}를 정보는 사용자 질문을 대답하기에 적절하다'
+            else:
+                context["action_history"] = f'{context["action_history"]}\n{action_count}. 판단: {wiki_page}를 정보는 사용자 질문을 대답하기에 적절하지 않다'
+            action_count += 1
+        elif job == "history":
+            context["action_history"] = f'{context["action_history"]}\n{action_count}. 생각: 사용자의 이전 질문을 열람 해야겠다'
+            action_count += 1
+            chat_history = await speculation.get("history", lambda: self.aget_chat_history(conversation_id))
+            context["action_history"] = f'{context["action_history"]}\n{action_count}. 행동: 사용자의 이전 질문을 열람 했다'
+            action_count += 1
+            context["chat_history"] = chat_history
+        elif job == "search_internet":
+            context["action_history"] = f'{context["action_history"]}\n{action_count}. 생각: 인터넷에서 검색 해야겠다'
+            action_count += 1
+            context["search_result"] = await speculation.get("internet", lambda: self.asearch(user_message))
+            context["action_history"] = f'{context["action_history"]}\n{action_count}. 행동: 인터넷에서 검색해서 자료를 획득했다'
+            action_count += 1
+            y_or_n = await self._arun_chain(self._evaluate_check_chain, context)
+            if y_or_n == "Y" or y_or_n == "y":
+                context["information"] = f'{context["information"]}\n인터넷 검색 자료: {wiki_page} 정보\n{context["search_result"]}'
+                context["action_history"] = f'{context["action_history"]}\n{action_count}. 판단: 인터넷 정보는 사용자 질문을 대답하기에 적절하다'
+            else:
+                context["action_history"] = f'{context["action_history"]}\n{action_count}. 판단: 인터넷 정보는 사용자 질문을 대답하기에 적절하지 않다'
+            action_count += 1
+        else:
+            return None
+        return action_count
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+from typing import Callable, Generic, TypeVar
+
+from kakao_developers_helper_bot.langchain_call.tracing import tracer
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    _name: str
+    _factory: Callable[[], T]
+    _value: T = None
+    _initialized: bool = False
+    _lock: threading.Lock
+
+    def __init__(self, name: str, factory: Callable[[], T]) -> None:
+        self._name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        return self._initialized
+
+    def get(self) -> T:
+        if self._initialized:
+            return self._value
+        with self._lock:
+            if not self._initialized:
+                with tracer.span("startup", self._name):
+                    self._value = self._factory()
+                self._initialized = True
+        return self._value
+
+    # the first get() opens stores and builds indexes; async handlers must not run that on the event loop
+    async def aget(self) -> T:
+        if self._initialized:
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+    def warm_up_in_background(self) -> threading.Thread:
+        def warm_up() -> None:
+            try:
+                self.get()
+            except Exception as e:
+                print(f"FAILED warm up: {self._name} by({e})")
+
+        thread = threading.Thread(target=warm_up, name=f"warm-up-{self._name}", daemon=True)
+        thread.start()
+        return thread
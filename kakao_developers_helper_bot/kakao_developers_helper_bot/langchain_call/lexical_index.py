@@ -0,0 +1,106 @@
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Collection, List, Tuple
+
+
+class LexicalIndex:
+    _ngram_sizes: Tuple[int, ...]
+    _k1: float
+    _b: float
+    _documents: list[dict[str, str]]
+    _doc_lengths: list[int]
+    _postings: dict[str, list[list[int]]]
+    _avg_doc_length: float
+
+    def __init__(self, ngram_sizes: Tuple[int, ...] = (2, 3), k1: float = 1.2, b: float = 0.75) -> None:
+        self._ngram_sizes = ngram_sizes
+        self._k1 = k1
+        self._b = b
+        self._documents = []
+        self._doc_lengths = []
+        self._postings = {}
+        self._avg_doc_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def terms(self, text: str) -> List[str]:
+        text = unicodedata.normalize("NFC", text).lower()
+        terms = []
+        for word in re.findall(r"\w+", text):
+            if len(word) < min(self._ngram_sizes):
+                terms.append(word)
+                continue
+            for n in self._ngram_sizes:
+                terms.extend(word[i:i + n] for i in range(len(word) - n + 1))
+        return terms
+
+    def build(self, documents: List[dict[str, str]]) -> None:
+        self._documents = documents
+        self._doc_lengths = []
+        self._postings = {}
+        for doc_index, document in enumerate(documents):
+            counts = Counter(self.terms(document["text"]))
+            self._doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append([doc_index, tf])
+        self._avg_doc_length = sum(self._doc_lengths) / len(self._doc_lengths) if self._doc_lengths else 0.0
+
+    def search(self, query: str, k: int = 4,
+               sources: Collection[str] = ()) -> List[Tuple[dict[str, str], float, float]]:
+        if not self._documents:
+            return []
+        query_terms = set(self.terms(query))
+        scores: dict[int, float] = {}
+        matched: dict[int, int] = {}
+        for term in query_terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self._documents) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, tf in postings:
+                if sources and self._documents[doc_index]["source"] not in sources:
+                    continue
+                norm = self._k1 * (1 - self._b + self._b * self._doc_lengths[doc_index] / self._avg_doc_length)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self._k1 + 1) / (tf + norm)
+                matched[doc_index] = matched.get(doc_index, 0) + 1
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        # coverage is the fraction of query n-grams found in the document, used to judge lexical confidence
+        return [(self._documents[doc_index], score, matched[doc_index] / len(query_terms))
+                for doc_index, score in ranked]
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "ngram_sizes": list(self._ngram_sizes),
+                "documents": self._documents,
+                "doc_lengths": self._doc_lengths,
+                "postings": self._postings,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(ngram_sizes=tuple(data["ngram_sizes"]))
+        index._documents = data["documents"]
+        index._doc_lengths = data["doc_lengths"]
+        index._postings = data["postings"]
+        index._avg_doc_length = sum(index._doc_lengths) / len(index._doc_lengths) if index._doc_lengths else 0.0
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1 / (k + rank + 1)
+    return [key for key, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
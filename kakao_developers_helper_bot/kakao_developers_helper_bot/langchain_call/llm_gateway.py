@@ -0,0 +1,270 @@
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, TypeVar
+
+import openai
+from langchain.schema.embeddings import Embeddings
+
+from kakao_developers_helper_bot.langchain_call.tracing import tracer
+
+T = TypeVar("T")
+
+INTERACTIVE = 0
+INGESTION = 10
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+)
+
+
+class LlmUnavailableError(Exception):
+    pass
+
+
+class LlmGateway:
+    _requests_per_minute: int
+    _tokens_per_minute: int
+    _max_concurrency: int
+    _max_retries: int
+    _max_queue_seconds: float
+    _failure_threshold: int
+    _cooldown_seconds: float
+    _condition: threading.Condition
+    _waiters: list[tuple[int, int]]
+    _tickets: "itertools.count[int]"
+    _window: "deque[tuple[float, int]]"
+    _window_tokens: int = 0
+    _in_flight: int = 0
+    _consecutive_failures: int = 0
+    _opened_at: float = 0.0
+    rejected: int = 0
+    retries: int = 0
+
+    def __init__(self, requests_per_minute: int = 3500, tokens_per_minute: int = 180000, max_concurrency: int = 16,
+                 max_retries: int = 3, max_queue_seconds: float = 15.0, failure_threshold: int = 5,
+                 cooldown_seconds: float = 30.0) -> None:
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._tickets = itertools.count()
+        self._window = deque()
+        self.configure(requests_per_minute, tokens_per_minute, max_concurrency, max_retries, max_queue_seconds,
+                       failure_threshold, cooldown_seconds)
+
+    def configure(self, requests_per_minute: int = 3500, tokens_per_minute: int = 180000, max_concurrency: int = 16,
+                  max_retries: int = 3, max_queue_seconds: float = 15.0, failure_threshold: int = 5,
+                  cooldown_seconds: float = 30.0) -> None:
+        with self._condition:
+            self._requests_per_minute = requests_per_minute
+            self._tokens_per_minute = tokens_per_minute
+            self._max_concurrency = max_concurrency
+            self._max_retries = max_retries
+            self._max_queue_seconds = max_queue_seconds
+            self._failure_threshold = failure_threshold
+            self._cooldown_seconds = cooldown_seconds
+            self._condition.notify_all()
+
+    def is_open(self) -> bool:
+        with self._condition:
+            return self._is_open(time.monotonic())
+
+    def _is_open(self, now: float) -> bool:
+        # after the cooldown the breaker is half-open: calls go through and the next outcome decides
+        return self._consecutive_failures >= self._failure_threshold and now - self._opened_at < self._cooldown_seconds
+
+    def _wait_seconds(self, tokens: int, now: float) -> float:
+        while self._window and now - self._window[0][0] >= 60:
+            self._window_tokens -= self._window.popleft()[1]
+        if self._in_flight >= self._max_concurrency:
+            return 0.05
+        if len(self._window) >= self._requests_per_minute:
+            return 60 - (now - self._window[0][0])
+        # a single request larger than the whole budget is let through once the window is empty
+        if self._window and self._window_tokens + tokens > self._tokens_per_minute:
+            return 60 - (now - self._window[0][0])
+        return 0.0
+
+    def _try_acquire(self, ticket: tuple[int, int], tokens: int, deadline: Optional[float]) -> float:
+        now = time.monotonic()
+        if self._is_open(now) or (deadline is not None and now > deadline):
+            self._leave(ticket)
+            self.rejected += 1
+            raise LlmUnavailableError("circuit open" if self._is_open(now) else "llm queue saturated")
+        if self._waiters[0] != ticket:
+            return 0.05
+        wait_seconds = self._wait_seconds(tokens, now)
+        if wait_seconds > 0:
+            return wait_seconds
+        heapq.heappop(self._waiters)
+        self._window.append((now, tokens))
+        self._window_tokens += tokens
+        self._in_flight += 1
+        self._condition.notify_all()
+        return 0.0
+
+    def _enqueue(self, priority: int) -> tuple[tuple[int, int], Optional[float]]:
+        ticket = (priority, next(self._tickets))
+        heapq.heappush(self._waiters, ticket)
+        # ingestion may wait as long as it takes; interactive turns give up and degrade instead
+        deadline = time.monotonic() + self._max_queue_seconds if priority == INTERACTIVE else None
+        return ticket, deadline
+
+    def _leave(self, ticket: tuple[int, int]) -> None:
+        if ticket in self._waiters:
+            self._waiters.remove(ticket)
+            heapq.heapify(self._waiters)
+            self._condition.notify_all()
+
+    def acquire(self, tokens: int, priority: int = INTERACTIVE) -> None:
+        with self._condition:
+            ticket, deadline = self._enqueue(priority)
+            while True:
+                wait_seconds = self._try_acquire(ticket, tokens, deadline)
+                if wait_seconds == 0:
+                    return
+                self._condition.wait(timeout=min(wait_seconds, 0.25))
+
+    async def aacquire(self, tokens: int, priority: int = INTERACTIVE) -> None:
+        with self._condition:
+            ticket, deadline = self._enqueue(priority)
+        try:
+            while True:
+                with self._condition:
+                    wait_seconds = self._try_acquire(ticket, tokens, deadline)
+                if wait_seconds == 0:
+                    return
+                await asyncio.sleep(min(wait_seconds, 0.25))
+        except asyncio.CancelledError:
+            with self._condition:
+                self._leave(ticket)
+            raise
+
+    # failed=None releases the slot without telling the breaker anything, e.g. for cancelled or invalid requests
+    def release(self, failed: Optional[bool] = False) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if failed:
+                self._consecutive_failures += 1
+                if self._consecutive_failures >= self._failure_threshold:
+                    self._opened_at = time.monotonic()
+            elif failed is not None:
+                self._consecutive_failures = 0
+            self._condition.notify_all()
+
+    def _backoff(self, attempt: int) -> float:
+        self.retries += 1
+        # full jitter so a burst of 429s does not retry in lockstep
+        return random.uniform(0, min(2 ** attempt, 20))
+
+    def call(self, fn: Callable[[], T], tokens: int, priority: int = INTERACTIVE,
+             max_retries: Optional[int] = None) -> T:
+        max_retries = self._max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            self.acquire(tokens, priority)
+            try:
+                result = fn()
+            except RETRYABLE_ERRORS as e:
+                self.release(failed=True)
+                if attempt == max_retries or self.is_open():
+                    raise LlmUnavailableError(f"llm failed after {attempt + 1} attempts by({e})") from e
+                time.sleep(self._backoff(attempt))
+                print(f"llm retry {attempt + 1}/{max_retries} by({e})")
+                continue
+            except BaseException:
+                self.release(failed=None)
+                raise
+            self.release()
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], tokens: int, priority: int = INTERACTIVE,
+                    max_retries: Optional[int] = None) -> T:
+        max_retries = self._max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            with tracer.span("gateway", "acquire", priority=priority, tokens=tokens):
+                await self.aacquire(tokens, priority)
+            try:
+                result = await fn()
+            except RETRYABLE_ERRORS as e:
+                self.release(failed=True)
+                if attempt == max_retries or self.is_open():
+                    raise LlmUnavailableError(f"llm failed after {attempt + 1} attempts by({e})") from e
+                await asyncio.sleep(self._backoff(attempt))
+                print(f"llm retry {attempt + 1}/{max_retries} by({e})")
+                continue
+            except BaseException:
+                self.release(failed=None)
+                raise
+            self.release()
+            return result
+
+    # the slot is held until the stream is read to the end, so errors mid-stream reach the breaker;
+    # a stream is only retried while nothing has been yielded yet
+    async def astream(self, fn: Callable[[], Awaitable[AsyncIterator[T]]], tokens: int, priority: int = INTERACTIVE,
+                      max_retries: Optional[int] = None) -> AsyncIterator[T]:
+        max_retries = self._max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            with tracer.span("gateway", "acquire", priority=priority, tokens=tokens):
+                await self.aacquire(tokens, priority)
+            started = False
+            try:
+                async for item in await fn():
+                    started = True
+                    yield item
+            except RETRYABLE_ERRORS as e:
+                self.release(failed=True)
+                if started or attempt == max_retries or self.is_open():
+                    raise LlmUnavailableError(f"llm failed after {attempt + 1} attempts by({e})") from e
+                await asyncio.sleep(self._backoff(attempt))
+                print(f"llm retry {attempt + 1}/{max_retries} by({e})")
+                continue
+            except BaseException:
+                # includes GeneratorExit when the reader stops early
+                self.release(failed=None)
+                raise
+            self.release()
+            return
+
+    def stats(self) -> dict[str, Any]:
+        with self._condition:
+            return {
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "window_requests": len(self._window),
+                "window_tokens": self._window_tokens,
+                "circuit_open": self._is_open(time.monotonic()),
+                "rejected": self.rejected,
+                "retries": self.retries,
+            }
+
+
+class GovernedEmbeddings(Embeddings):
+    model: str
+    _embeddings: Embeddings
+    _gateway: LlmGateway
+    _count_tokens: Callable[[str], int]
+
+    def __init__(self, embeddings: Embeddings, gateway: LlmGateway, count_tokens: Callable[[str], int]) -> None:
+        # keep the wrapped model name so cached embeddings stay valid
+        self.model = getattr(embeddings, "model", embeddings.__class__.__name__)
+        self._embeddings = embeddings
+        self._gateway = gateway
+        self._count_tokens = count_tokens
+
+    # document embeddings only come from push_texts, so they queue behind interactive turns
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        tokens = sum(self._count_tokens(text) for text in texts)
+        return self._gateway.call(lambda: self._embeddings.embed_documents(texts), tokens, priority=INGESTION)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._gateway.call(lambda: self._embeddings.embed_query(text), self._count_tokens(text))
+
+
+llm_gateway = LlmGateway()
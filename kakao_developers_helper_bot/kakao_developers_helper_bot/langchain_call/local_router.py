@@ -0,0 +1,107 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from kakao_developers_helper_bot.langchain_call.chroma_db_repository import ChromaDbRepository
+
+HISTORY_CUES = re.compile(r"(이전|아까|방금|앞에서|위에서|그거|그것|previous|earlier|before)", re.IGNORECASE)
+INTERNET_CUES = re.compile(r"(최신|최근|뉴스|오늘|현재|요즘|latest|recent|news|today)", re.IGNORECASE)
+SUFFICIENT_INFORMATION_LENGTH = 2000
+
+
+class LocalRouter:
+    _vector_db: ChromaDbRepository
+    _log_path: str
+    _wiki_margin: float
+    _job_threshold: float
+    _centroids: dict[str, np.ndarray]
+    _centroid_version: str = None
+    _lock: threading.Lock
+
+    def __init__(self, vector_db: ChromaDbRepository, log_path: str, wiki_margin: float = 0.03,
+                 job_threshold: float = 0.75) -> None:
+        self._vector_db = vector_db
+        self._log_path = log_path
+        self._wiki_margin = wiki_margin
+        self._job_threshold = job_threshold
+        self._centroids = {}
+        self._lock = threading.Lock()
+
+    def _get_centroids(self) -> dict[str, np.ndarray]:
+        with self._lock:
+            corpus_version = self._vector_db.corpus_version()
+            if self._centroid_version != corpus_version:
+                centroids = {}
+                for collection_name in self._vector_db.collection_names():
+                    embeddings = np.asarray(self._vector_db.collection_embeddings(collection_name), dtype=np.float32)
+                    if len(embeddings) == 0:
+                        continue
+                    centroid = embeddings.mean(axis=0)
+                    centroids[collection_name] = centroid / np.linalg.norm(centroid)
+                self._centroids = centroids
+                self._centroid_version = corpus_version
+            return self._centroids
+
+    # callers embed once per turn and pass the vector to every routing call
+    def embed(self, user_message: str) -> np.ndarray:
+        query = np.asarray(self._vector_db.embed_query(user_message), dtype=np.float32)
+        return query / np.linalg.norm(query)
+
+    def route_wiki_page(self, user_message: str, visited: set[str] = frozenset(),
+                        query: np.ndarray = None) -> Tuple[Optional[str], float]:
+        centroids = {name: centroid for name, centroid in self._get_centroids().items() if name not in visited}
+        if not centroids:
+            return None, 0.0
+        if query is None:
+            query = self.embed(user_message)
+        ranked = sorted(((float(centroid @ query), name) for name, centroid in centroids.items()), reverse=True)
+        margin = ranked[0][0] - ranked[1][0] if len(ranked) > 1 else 1.0
+        if margin < self._wiki_margin:
+            return None, margin
+        return ranked[0][1], margin
+
+    def _guess_job(self, context: dict, visited: set[str], fetched_jobs: set[str],
+                   query: Optional[np.ndarray]) -> Tuple[Optional[str], float]:
+        user_message = context["user_message"]
+        if len(context["information"]) >= SUFFICIENT_INFORMATION_LENGTH:
+            return "response", 1.0
+        # an empty history is still a fetched one, so it is never asked for twice in a turn
+        if "history" not in fetched_jobs and HISTORY_CUES.search(user_message):
+            return "history", 0.8
+        if "search_internet" not in fetched_jobs and INTERNET_CUES.search(user_message):
+            return "search_internet", 0.8
+        if context["information"]:
+            return "response", 0.7
+        wiki_page, _ = self.route_wiki_page(user_message, visited, query)
+        if wiki_page is not None:
+            return "search_kakao_wiki", 0.8
+        if visited.issuperset(self._vector_db.collection_names()):
+            # every wiki page was read and none of it was useful
+            return ("response", 0.8) if "search_internet" in fetched_jobs else ("search_internet", 0.8)
+        return None, 0.0
+
+    # fetched_jobs is the turn's record of the history / web search jobs already run
+    def route_job(self, context: dict, visited: set[str], fetched_jobs: set[str],
+                  query: np.ndarray = None) -> Tuple[Optional[str], float]:
+        job, confidence = self._guess_job(context, visited, fetched_jobs, query)
+        if confidence < self._job_threshold:
+            return None, confidence
+        return job, confidence
+
+    def log(self, stage: str, user_message: str, decision: str, confidence: float, source: str) -> None:
+        record = {
+            "time": time.time(),
+            "stage": stage,
+            "user_message": user_message,
+            "decision": decision,
+            "confidence": round(confidence, 4),
+            "source": source,
+        }
+        os.makedirs(os.path.dirname(self._log_path), exist_ok=True)
+        with open(self._log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
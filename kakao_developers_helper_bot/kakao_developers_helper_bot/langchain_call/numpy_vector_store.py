@@ -0,0 +1,351 @@
+import json
+import os
+import shutil
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+
+from kakao_developers_helper_bot.langchain_call.vector_store import VectorStore
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+class Segment:
+    name: str
+    vectors: np.ndarray
+    scales: Optional[np.ndarray]
+    ids: list[str]
+    documents: list[str]
+    metadatas: list[dict]
+    live: np.ndarray
+    _columns: dict[str, np.ndarray]
+
+    def __init__(self, directory: str, name: str, deleted_rows: list[int]) -> None:
+        self.name = name
+        self.vectors = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        scales_path = os.path.join(directory, f"{name}.scales.npy")
+        self.scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        with open(os.path.join(directory, f"{name}.json"), "r", encoding="utf-8") as f:
+            side = json.load(f)
+        self.ids = side["ids"]
+        self.documents = side["documents"]
+        self.metadatas = side["metadatas"]
+        self.live = np.ones(len(self.ids), dtype=bool)
+        self.live[deleted_rows] = False
+        self._columns = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    # metadata values as an array, so equality filters are one vectorized comparison
+    def column(self, key: str) -> np.ndarray:
+        column = self._columns.get(key)
+        if column is None:
+            column = np.array([(metadata or {}).get(key) for metadata in self.metadatas], dtype=object)
+            self._columns[key] = column
+        return column
+
+    def set_metadata(self, row: int, metadata: dict) -> None:
+        self.metadatas[row] = metadata
+        self._columns.clear()
+
+    def mask(self, where: Optional[dict]) -> np.ndarray:
+        mask = self.live.copy()
+        for key, value in (where or {}).items():
+            mask &= self.column(key) == value
+        return mask
+
+    def dequantize(self, start: int, stop: int) -> np.ndarray:
+        block = np.asarray(self.vectors[start:stop], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:stop, None] / 127.0
+        return block
+
+
+class NumpyVectorStore(VectorStore):
+    _directory: str
+    _dtype: str
+    _block_rows: int
+    _compact_ratio: float
+    _max_segments: int
+    _segments: list[Segment]
+    _locations: dict[str, tuple[int, int]]
+    _deleted: dict[str, list[int]]
+    _next_segment: int = 1
+    _loaded: bool = False
+    _manifest_mtime: Optional[int] = None
+    _lock: threading.RLock
+
+    def __init__(self, directory: str, dtype: str = "float32", block_rows: int = 8192,
+                 compact_ratio: float = 0.3, max_segments: int = 16) -> None:
+        if dtype not in DTYPES:
+            raise ValueError(f"unsupported vector dtype: {dtype}")
+        self._directory = directory
+        self._dtype = dtype
+        self._block_rows = block_rows
+        self._compact_ratio = compact_ratio
+        self._max_segments = max_segments
+        self._segments = []
+        self._locations = {}
+        self._deleted = {}
+        self._lock = threading.RLock()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self._directory, "segments.json")
+
+    def _stat_manifest(self) -> Optional[int]:
+        try:
+            return os.stat(self._manifest_path()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    # another worker may have written the store since it was loaded; a changed manifest means reload it
+    def _load(self) -> None:
+        if self._loaded and self._stat_manifest() == self._manifest_mtime:
+            return
+        with self._lock:
+            mtime = self._stat_manifest()
+            if self._loaded and mtime == self._manifest_mtime:
+                return
+            self._segments, self._locations, self._deleted = [], {}, {}
+            self._next_segment = 1
+            if mtime is not None:
+                with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest["dtype"] != self._dtype:
+                    print(f"vector store {self._directory} is {manifest['dtype']}, ignoring dtype={self._dtype}")
+                    self._dtype = manifest["dtype"]
+                self._next_segment = manifest["next_segment"]
+                self._deleted = manifest["deleted"]
+                for name in manifest["segments"]:
+                    self._append_segment(Segment(self._directory, name, self._deleted.get(name, [])))
+            self._manifest_mtime = mtime
+            self._loaded = True
+
+    def _append_segment(self, segment: Segment) -> None:
+        index = len(self._segments)
+        self._segments.append(segment)
+        for row, chunk_id in enumerate(segment.ids):
+            if segment.live[row]:
+                self._locations[chunk_id] = (index, row)
+
+    def _save_manifest(self) -> None:
+        os.makedirs(self._directory, exist_ok=True)
+        tmp_path = f"{self._manifest_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "dtype": self._dtype,
+                "next_segment": self._next_segment,
+                "segments": [segment.name for segment in self._segments],
+                "deleted": self._deleted,
+            }, f)
+        os.replace(tmp_path, self._manifest_path())
+        self._manifest_mtime = self._stat_manifest()
+
+    # written aside and renamed, so a reader never loads a half-written side file
+    def _write_side(self, name: str, ids: List[str], documents: List[str], metadatas: List[dict]) -> None:
+        path = os.path.join(self._directory, f"{name}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    def _encode(self, embeddings: np.ndarray) -> tuple[np.ndarray, Optional[np.ndarray]]:
+        embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        if self._dtype != "int8":
+            return embeddings.astype(DTYPES[self._dtype]), None
+        # symmetric per-row int8 quantization; the scale restores the magnitude at query time
+        scales = np.maximum(np.abs(embeddings).max(axis=1), 1e-12).astype(np.float32)
+        return np.round(embeddings / scales[:, None] * 127).astype(np.int8), scales
+
+    def _write_segment(self, ids: List[str], embeddings: np.ndarray, documents: List[str],
+                       metadatas: List[dict]) -> Segment:
+        os.makedirs(self._directory, exist_ok=True)
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        vectors, scales = self._encode(embeddings)
+        np.save(os.path.join(self._directory, f"{name}.npy"), vectors)
+        if scales is not None:
+            np.save(os.path.join(self._directory, f"{name}.scales.npy"), scales)
+        self._write_side(name, ids, documents, metadatas)
+        return Segment(self._directory, name, [])
+
+    def _mark_deleted(self, chunk_id: str) -> bool:
+        location = self._locations.pop(chunk_id, None)
+        if location is None:
+            return False
+        segment_index, row = location
+        segment = self._segments[segment_index]
+        segment.live[row] = False
+        self._deleted.setdefault(segment.name, []).append(row)
+        return True
+
+    def count(self) -> int:
+        self._load()
+        return len(self._locations)
+
+    # every add is a new append-only segment, merged once there are too many; re-added ids replace their previous row
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str],
+            metadatas: List[dict]) -> None:
+        if not ids:
+            return
+        self._load()
+        with self._lock:
+            for chunk_id in ids:
+                self._mark_deleted(chunk_id)
+            segment = self._write_segment(list(ids), np.asarray(embeddings, dtype=np.float32), list(documents),
+                                          [dict(metadata or {}) for metadata in metadatas])
+            self._append_segment(segment)
+            self._save_manifest()
+            self._maybe_compact()
+
+    def delete(self, ids: List[str]) -> None:
+        self._load()
+        with self._lock:
+            if any([self._mark_deleted(chunk_id) for chunk_id in ids]):
+                self._save_manifest()
+                self._maybe_compact()
+
+    def update_metadatas(self, ids: List[str], metadatas: List[dict]) -> None:
+        self._load()
+        with self._lock:
+            changed = set()
+            for chunk_id, metadata in zip(ids, metadatas):
+                location = self._locations.get(chunk_id)
+                if location is None:
+                    continue
+                self._segments[location[0]].set_metadata(location[1], dict(metadata or {}))
+                changed.add(location[0])
+            for segment_index in changed:
+                segment = self._segments[segment_index]
+                self._write_side(segment.name, segment.ids, segment.documents, segment.metadatas)
+            if changed:
+                # touches the manifest so other workers pick the new metadata up
+                self._save_manifest()
+
+    def _maybe_compact(self) -> None:
+        total = sum(len(segment) for segment in self._segments)
+        if len(self._segments) > self._max_segments or \
+                (total > 0 and (total - len(self._locations)) / total >= self._compact_ratio):
+            self.compact()
+
+    def compact(self) -> None:
+        self._load()
+        with self._lock:
+            old_segments = self._segments
+            ids, embeddings, documents, metadatas = [], [], [], []
+            for segment in old_segments:
+                rows = np.flatnonzero(segment.live)
+                if len(rows) == 0:
+                    continue
+                embeddings.append(segment.dequantize(0, len(segment))[rows])
+                for row in rows:
+                    ids.append(segment.ids[row])
+                    documents.append(segment.documents[row])
+                    metadatas.append(segment.metadatas[row])
+
+            self._segments, self._locations, self._deleted = [], {}, {}
+            if ids:
+                self._append_segment(self._write_segment(ids, np.concatenate(embeddings), documents, metadatas))
+            self._save_manifest()
+            for segment in old_segments:
+                for suffix in (".npy", ".scales.npy", ".json"):
+                    path = os.path.join(self._directory, f"{segment.name}{suffix}")
+                    if os.path.exists(path):
+                        os.remove(path)
+            print(f"compacted vector store: {len(old_segments)} segments -> {len(self._segments)}")
+
+    def get(self, where: Optional[dict] = None, include: tuple = ("documents", "metadatas")) -> dict[str, list]:
+        self._load()
+        result = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        for segment in list(self._segments):
+            rows = np.flatnonzero(segment.mask(where))
+            result["ids"].extend(segment.ids[row] for row in rows)
+            if "documents" in include:
+                result["documents"].extend(segment.documents[row] for row in rows)
+            if "metadatas" in include:
+                result["metadatas"].extend(segment.metadatas[row] for row in rows)
+            if "embeddings" in include and len(rows):
+                result["embeddings"].extend(segment.dequantize(0, len(segment))[rows].tolist())
+        return result
+
+    def _scores(self, segment: Segment, queries: np.ndarray) -> np.ndarray:
+        # block-wise so float16/int8 segments are widened to float32 a slice at a time
+        scores = np.empty((len(segment), len(queries)), dtype=np.float32)
+        for start in range(0, len(segment), self._block_rows):
+            stop = min(start + self._block_rows, len(segment))
+            scores[start:stop] = segment.dequantize(start, stop) @ queries.T
+        return scores
+
+    @staticmethod
+    def _normalize(embeddings: List[List[float]]) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def _top_hits(self, segments: List[Segment], offsets: np.ndarray, scores: np.ndarray, n_results: int,
+                  with_embeddings: bool) -> List[dict[str, Any]]:
+        k = min(n_results, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        hits = []
+        for index in top:
+            score = float(scores[index])
+            if score == -np.inf:
+                break
+            segment_index = int(np.searchsorted(offsets, index, side="right")) - 1
+            segment, row = segments[segment_index], int(index - offsets[segment_index])
+            hits.append({
+                "id": segment.ids[row],
+                "document": segment.documents[row],
+                "metadata": segment.metadatas[row],
+                "distance": max(2 - 2 * score, 0.0),
+                "embedding": segment.dequantize(row, row + 1)[0].tolist() if with_embeddings else None,
+            })
+        return hits
+
+    def query(self, query_embeddings: List[List[float]], n_results: int, where: Optional[dict] = None,
+              with_embeddings: bool = False) -> List[List[dict[str, Any]]]:
+        self._load()
+        segments = list(self._segments)
+        if not segments or n_results <= 0:
+            return [[] for _ in query_embeddings]
+
+        queries = self._normalize(query_embeddings)
+        scores = []
+        for segment in segments:
+            segment_scores = self._scores(segment, queries)
+            segment_scores[~segment.mask(where)] = -np.inf
+            scores.append(segment_scores)
+        scores = np.concatenate(scores)
+        offsets = np.cumsum([0] + [len(segment) for segment in segments])
+        return [self._top_hits(segments, offsets, scores[:, i], n_results, with_embeddings)
+                for i in range(len(queries))]
+
+    # the matrix is scored once; each where clause only applies its own mask to the shared scores
+    def fan_out_query(self, query_embedding: List[float], wheres: List[Optional[dict]], n_results: int,
+                      with_embeddings: bool = False) -> List[List[dict[str, Any]]]:
+        self._load()
+        segments = list(self._segments)
+        if not segments or n_results <= 0:
+            return [[] for _ in wheres]
+
+        query = self._normalize([query_embedding])
+        scores = np.concatenate([self._scores(segment, query)[:, 0] for segment in segments])
+        offsets = np.cumsum([0] + [len(segment) for segment in segments])
+        hits = []
+        for where in wheres:
+            mask = np.concatenate([segment.mask(where) for segment in segments])
+            hits.append(self._top_hits(segments, offsets, np.where(mask, scores, -np.inf), n_results,
+                                       with_embeddings))
+        return hits
+
+    def delete_all(self) -> None:
+        with self._lock:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._segments, self._locations, self._deleted = [], {}, {}
+            self._next_segment = 1
+            self._manifest_mtime = None
+            self._loaded = True
+
+    def warm_up(self) -> None:
+        self._load()
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Awaitable, Callable, Optional, Tuple
+
+
+class SearchCache:
+    _db_path: str
+    _ttl_seconds: float
+    _max_entries: int
+    _local: threading.local
+    # futures belong to one event loop, so a fetch is only shared with callers on the same loop
+    _in_flight: dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Future]
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+
+    def __init__(self, db_path: str, ttl_seconds: float = 6 * 60 * 60, max_entries: int = 5000) -> None:
+        self._db_path = db_path
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._local = threading.local()
+        self._in_flight = {}
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS search_results ("
+                "key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "last_used REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS search_results_last_used ON search_results (last_used)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._db_path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(kind: str, query: str) -> str:
+        normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFC", query)).strip().lower()
+        return f"{kind}:{hashlib.sha256(normalized.encode('utf-8')).hexdigest()}"
+
+    def get(self, kind: str, query: str) -> Optional[str]:
+        key = self.key(kind, query)
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute("SELECT value, created_at FROM search_results WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self._ttl_seconds:
+                return None
+            connection.execute("UPDATE search_results SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, kind: str, query: str, value: str) -> None:
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO search_results (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (self.key(kind, query), value, now, now),
+            )
+            connection.execute(
+                "DELETE FROM search_results WHERE created_at < ? OR key IN ("
+                "SELECT key FROM search_results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (now - self._ttl_seconds, self._max_entries),
+            )
+
+    async def aget_or_fetch(self, kind: str, query: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        value, _ = await self.aget_or_fetch_with_status(kind, query, fetch)
+        return value
+
+    # the flag is True when this call did not pay for a fetch, i.e. a cache hit or a coalesced wait
+    async def aget_or_fetch_with_status(self, kind: str, query: str,
+                                        fetch: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        loop = asyncio.get_running_loop()
+        key = (loop, self.key(kind, query))
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight), True
+
+        future = loop.create_future()
+        self._in_flight[key] = future
+        try:
+            value = await asyncio.to_thread(self.get, kind, query)
+            hit = value is not None
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+                value = await fetch()
+                await asyncio.to_thread(self.put, kind, query, value)
+            future.set_result(value)
+            return value, hit
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved when nobody else was waiting on it
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Optional
+
+from kakao_developers_helper_bot.langchain_call.chroma_collection_registry import ChromaCollectionRegistry, \
+    collection_registry
+
+
+class SemanticAnswerCache:
+    _persist_dir: str
+    _collection_name: str
+    _registry: ChromaCollectionRegistry
+    _corpus_version: Callable[[], str]
+    _similarity_threshold: float
+    _ttl_seconds: float
+    _prune_interval_seconds: float
+    _last_pruned: float = 0.0
+    _prune_lock: threading.Lock
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self, persist_dir: str, corpus_version: Callable[[], str], similarity_threshold: float = 0.95,
+                 ttl_seconds: float = 24 * 60 * 60, registry: ChromaCollectionRegistry = None,
+                 prune_interval_seconds: float = 60 * 60) -> None:
+        self._persist_dir = persist_dir
+        self._collection_name = "answer_cache"
+        self._corpus_version = corpus_version
+        self._similarity_threshold = similarity_threshold
+        self._ttl_seconds = ttl_seconds
+        self._prune_interval_seconds = prune_interval_seconds
+        self._prune_lock = threading.Lock()
+        self._registry = registry if registry is not None else collection_registry
+
+    def _db(self):
+        return self._registry.get(self._persist_dir, self._collection_name)
+
+    def lookup(self, question: str, mode: str) -> Optional[str]:
+        db = self._db()
+        # chroma raises when asked for more neighbours than match the filter, or when none match it at all
+        available = len(db._collection.get(where={"mode": mode}, include=[])["ids"])
+        if available == 0:
+            self.misses += 1
+            return None
+
+        corpus_version = self._corpus_version()
+        now = time.time()
+        stale = False
+        # chroma returns squared L2 distance; for unit-length OpenAI embeddings that is 2 - 2 * cosine
+        for doc, distance in db.similarity_search_with_score(question, k=min(4, available),
+                                                              filter={"mode": mode}):
+            similarity = 1 - distance / 2
+            if similarity < self._similarity_threshold:
+                break
+            if self._is_stale(doc.metadata, corpus_version, now):
+                stale = True
+                continue
+            self.hits += 1
+            return doc.metadata["answer"]
+
+        self.misses += 1
+        if stale:
+            # a stale neighbour was just seen, so pruning now pays off without waiting for the interval
+            self._maybe_prune(force=True)
+        return None
+
+    def _is_stale(self, metadata: dict, corpus_version: str, now: float) -> bool:
+        return metadata.get("corpus_version") != corpus_version or \
+            now - metadata.get("created_at", 0) > self._ttl_seconds
+
+    # stale entries would otherwise pile up and crowd the k nearest neighbours out of every lookup
+    def prune(self) -> int:
+        db = self._db()
+        corpus_version = self._corpus_version()
+        now = time.time()
+        result = db._collection.get(include=["metadatas"])
+        stale_ids = [chunk_id for chunk_id, metadata in zip(result["ids"], result["metadatas"])
+                     if self._is_stale(metadata or {}, corpus_version, now)]
+        if stale_ids:
+            db._collection.delete(ids=stale_ids)
+            db.persist()
+        return len(stale_ids)
+
+    def _maybe_prune(self, force: bool = False) -> None:
+        if not force and time.time() - self._last_pruned < self._prune_interval_seconds:
+            return
+        if not self._prune_lock.acquire(False):
+            return
+        try:
+            self._last_pruned = time.time()
+            print(f"pruned {self.prune()} stale answer cache entries")
+        finally:
+            self._prune_lock.release()
+
+    def store(self, question: str, answer: str, mode: str) -> None:
+        if not question.strip() or not answer.strip():
+            return
+        db = self._db()
+        db.add_texts(
+            [question],
+            metadatas=[{
+                "mode": mode,
+                "answer": answer,
+                "corpus_version": self._corpus_version(),
+                "created_at": time.time(),
+            }],
+        )
+        db.persist()
+        self._maybe_prune()
+
+    async def alookup(self, question: str, mode: str) -> Optional[str]:
+        return await asyncio.to_thread(self.lookup, question, mode)
+
+    async def astore(self, question: str, answer: str, mode: str) -> None:
+        await asyncio.to_thread(self.store, question, answer, mode)
+
+    def clear(self) -> None:
+        self._db().delete_collection()
+        self._registry.invalidate(self._persist_dir, self._collection_name)
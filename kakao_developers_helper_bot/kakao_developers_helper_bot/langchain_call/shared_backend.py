@@ -0,0 +1,105 @@
+import asyncio
+import os
+from multiprocessing.managers import BaseManager
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
+
+from kakao_developers_helper_bot.langchain_call.ingestion_pipeline import IngestionProgress
+
+
+class SharedBackendManager(BaseManager):
+    pass
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    # "host:port" listens on TCP, anything else is taken as a unix socket path
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def serve(address: str, authkey: bytes, objects: dict[str, Callable[[], Any]]) -> None:
+    # every factory returns the same process-wide object, so all workers share one index, history and cache
+    for name, factory in objects.items():
+        SharedBackendManager.register(name, callable=factory)
+    parsed_address = parse_address(address)
+    if isinstance(parsed_address, str) and os.path.exists(parsed_address):
+        # a socket left behind by a previous run
+        os.remove(parsed_address)
+    manager = SharedBackendManager(address=parsed_address, authkey=authkey)
+    server = manager.get_server()
+    if isinstance(parsed_address, str):
+        os.chmod(parsed_address, 0o600)
+    print(f"shared backend listening on {address}: {', '.join(objects)}")
+    server.serve_forever()
+
+
+def connect(address: str, authkey: bytes, names: List[str]) -> SharedBackendManager:
+    for name in names:
+        SharedBackendManager.register(name)
+    manager = SharedBackendManager(address=parse_address(address), authkey=authkey)
+    manager.connect()
+    return manager
+
+
+class RemoteChromaDbRepository:
+    _proxy: Any
+
+    def __init__(self, proxy: Any) -> None:
+        self._proxy = proxy
+
+    def collection_names(self) -> list[str]:
+        return self._proxy.collection_names()
+
+    def corpus_version(self) -> str:
+        return self._proxy.corpus_version()
+
+    def warm_up(self) -> None:
+        self._proxy.warm_up()
+
+    def push_texts(self, max_concurrency: int = 4) -> IngestionProgress:
+        return self._proxy.push_texts(max_concurrency)
+
+    def embed_query(self, query: str) -> List[float]:
+        return self._proxy.embed_query(query)
+
+    def collection_embeddings(self, collection_name: str) -> List[List[float]]:
+        return self._proxy.collection_embeddings(collection_name)
+
+    def query_db(self, query: str, use_retriever: bool = False, collection_name: Union[str, List[str]] = "",
+                 k: int = 4, search_mode: str = "hybrid") -> list[str]:
+        return self._proxy.query_db(query, use_retriever, collection_name, k, search_mode)
+
+    async def aquery_db(self, query: str, use_retriever: bool = False, collection_name: Union[str, List[str]] = "",
+                        k: int = 4, search_mode: str = "hybrid") -> list[str]:
+        return await asyncio.to_thread(self.query_db, query, use_retriever, collection_name, k, search_mode)
+
+    def query_sources(self, query: str, collection_names: Iterable[str] = (), k_per_source: int = 4,
+                      k: Optional[int] = None) -> List[dict]:
+        return self._proxy.query_sources(query, list(collection_names), k_per_source, k)
+
+    async def aquery_sources(self, query: str, collection_names: Iterable[str] = (), k_per_source: int = 4,
+                             k: Optional[int] = None) -> List[dict]:
+        return await asyncio.to_thread(self.query_sources, query, list(collection_names), k_per_source, k)
+
+
+class RemoteSemanticAnswerCache:
+    _proxy: Any
+
+    def __init__(self, proxy: Any) -> None:
+        self._proxy = proxy
+
+    def lookup(self, question: str, mode: str) -> Optional[str]:
+        return self._proxy.lookup(question, mode)
+
+    def store(self, question: str, answer: str, mode: str) -> None:
+        self._proxy.store(question, answer, mode)
+
+    async def alookup(self, question: str, mode: str) -> Optional[str]:
+        return await asyncio.to_thread(self.lookup, question, mode)
+
+    async def astore(self, question: str, answer: str, mode: str) -> None:
+        await asyncio.to_thread(self.store, question, answer, mode)
+
+    def clear(self) -> None:
+        self._proxy.clear()
@@ -0,0 +1,42 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+
+class SpeculativeRetrieval:
+    _tasks: dict[str, asyncio.Task]
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self) -> None:
+        self._tasks = {}
+
+    def prefetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> None:
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.ensure_future(fetch())
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            self.misses += 1
+            self._tasks[key] = task = asyncio.ensure_future(fetch())
+        else:
+            self.hits += 1
+        return await task
+
+    # the result of a prefetch that already finished, without waiting for one still running
+    def peek(self, key: str) -> Optional[Any]:
+        task = self._tasks.get(key)
+        if task is None or not task.done() or task.cancelled() or task.exception() is not None:
+            return None
+        return task.result()
+
+    def discard(self, key: str) -> None:
+        task = self._tasks.pop(key, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+        self._tasks.clear()
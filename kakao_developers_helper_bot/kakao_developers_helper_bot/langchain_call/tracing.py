@@ -0,0 +1,162 @@
+import atexit
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_current_trace_id: contextvars.ContextVar[str] = contextvars.ContextVar("current_trace_id", default="")
+
+
+class Span:
+    kind: str
+    name: str
+    trace_id: str
+    attributes: dict[str, Any]
+    _started_at: float
+    duration_ms: float = 0.0
+
+    def __init__(self, kind: str, name: str, trace_id: str, attributes: dict[str, Any]) -> None:
+        self.kind = kind
+        self.name = name
+        self.trace_id = trace_id
+        self.attributes = attributes
+        self._started_at = time.perf_counter()
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        self.duration_ms = (time.perf_counter() - self._started_at) * 1000
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "time": time.time(),
+            "trace_id": self.trace_id,
+            "kind": self.kind,
+            "name": self.name,
+            "duration_ms": round(self.duration_ms, 3),
+            **self.attributes,
+        }
+
+
+class Histogram:
+    count: int = 0
+    total: float = 0.0
+    buckets: list[int]
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if value <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        labels = [f"le_{bound}" for bound in HISTOGRAM_BUCKETS_MS] + ["inf"]
+        return {"count": self.count, "sum_ms": round(self.total, 3), "buckets": dict(zip(labels, self.buckets))}
+
+
+class Tracer:
+    _export_path: str = ""
+    _counters: dict[str, float]
+    _histograms: dict[str, Histogram]
+    _lock: threading.Lock
+    _export_queue: "queue.SimpleQueue[dict[str, Any]]"
+    _write_lock: threading.Lock
+    _writer: threading.Thread = None
+
+    def __init__(self) -> None:
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._export_queue = queue.SimpleQueue()
+        self._write_lock = threading.Lock()
+
+    def configure(self, export_path: str = "") -> None:
+        self._export_path = export_path
+        if export_path:
+            os.makedirs(os.path.dirname(export_path), exist_ok=True)
+            if self._writer is None:
+                # spans are written in batches off the request path; whatever is still queued is written at exit
+                self._writer = threading.Thread(target=self._write_spans, name="span-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    @contextmanager
+    def turn(self, conversation_id: str) -> Iterator[Span]:
+        token = _current_trace_id.set(uuid.uuid4().hex)
+        try:
+            with self.span("turn", "generate_answer", conversation_id=conversation_id) as span:
+                yield span
+        finally:
+            _current_trace_id.reset(token)
+
+    @contextmanager
+    def span(self, kind: str, name: str, **attributes: Any) -> Iterator[Span]:
+        span = Span(kind, name, _current_trace_id.get(), attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            span.finish()
+            self._record(span)
+
+    def _record(self, span: Span) -> None:
+        key = f"{span.kind}:{span.name}"
+        with self._lock:
+            self._counters[f"{key}:count"] = self._counters.get(f"{key}:count", 0) + 1
+            for attribute in ("prompt_tokens", "completion_tokens"):
+                if attribute in span.attributes:
+                    counter = f"{key}:{attribute}"
+                    self._counters[counter] = self._counters.get(counter, 0) + span.attributes[attribute]
+            if "cache_hit" in span.attributes:
+                counter = f"{key}:cache_{'hit' if span.attributes['cache_hit'] else 'miss'}"
+                self._counters[counter] = self._counters.get(counter, 0) + 1
+            if "error" in span.attributes:
+                self._counters[f"{key}:error"] = self._counters.get(f"{key}:error", 0) + 1
+            self._histograms.setdefault(key, Histogram()).observe(span.duration_ms)
+        if self._export_path:
+            self._export_queue.put(span.to_dict())
+
+    def _write_spans(self) -> None:
+        while True:
+            self._write_batch([self._export_queue.get()])
+
+    def _write_batch(self, records: list[dict[str, Any]]) -> None:
+        while True:
+            try:
+                records.append(self._export_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not records or not self._export_path:
+            return
+        with self._write_lock, open(self._export_path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+
+    def flush(self) -> None:
+        if self._export_path:
+            self._write_batch([])
+
+    def metrics(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "histograms": {key: histogram.to_dict() for key, histogram in self._histograms.items()},
+            }
+
+
+tracer = Tracer()
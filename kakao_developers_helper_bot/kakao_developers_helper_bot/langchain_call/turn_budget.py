@@ -0,0 +1,65 @@
+import contextvars
+import time
+from typing import Optional
+
+_current_turn_budget: contextvars.ContextVar[Optional["TurnBudget"]] = \
+    contextvars.ContextVar("current_turn_budget", default=None)
+
+
+class TurnBudget:
+    max_seconds: float
+    max_llm_calls: int
+    max_tokens: int
+    max_actions: int
+    sufficient_information_chars: int
+    llm_calls: int = 0
+    tokens: int = 0
+    _started_at: float
+
+    def __init__(self, max_seconds: float = 20.0, max_llm_calls: int = 8, max_tokens: int = 24000,
+                 max_actions: int = 30, sufficient_information_chars: int = 2000) -> None:
+        self.max_seconds = max_seconds
+        self.max_llm_calls = max_llm_calls
+        self.max_tokens = max_tokens
+        self.max_actions = max_actions
+        self.sufficient_information_chars = sufficient_information_chars
+        self._started_at = time.perf_counter()
+
+    def start(self) -> "TurnBudget":
+        return TurnBudget(self.max_seconds, self.max_llm_calls, self.max_tokens, self.max_actions,
+                          self.sufficient_information_chars)
+
+    def activate(self) -> contextvars.Token:
+        return _current_turn_budget.set(self)
+
+    @staticmethod
+    def deactivate(token: contextvars.Token) -> None:
+        _current_turn_budget.reset(token)
+
+    @staticmethod
+    def current() -> Optional["TurnBudget"]:
+        return _current_turn_budget.get()
+
+    def record_llm_call(self, prompt_tokens: int, completion_tokens: int) -> None:
+        self.llm_calls += 1
+        self.tokens += prompt_tokens + completion_tokens
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started_at
+
+    def remaining_seconds(self) -> float:
+        return max(self.max_seconds - self.elapsed(), 0.0)
+
+    # the final answer is always generated, so these limits only bound the information gathering loop
+    def stop_reason(self, context: dict, action_count: int) -> Optional[str]:
+        if len(context["information"]) >= self.sufficient_information_chars:
+            return "sufficient_information"
+        if self.remaining_seconds() <= 0:
+            return "time"
+        if self.llm_calls >= self.max_llm_calls:
+            return "llm_calls"
+        if self.tokens >= self.max_tokens:
+            return "tokens"
+        if action_count >= self.max_actions:
+            return "actions"
+        return None
@@ -0,0 +1,152 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+import numpy as np
+
+from kakao_developers_helper_bot.langchain_call.chroma_collection_registry import ChromaCollectionRegistry, \
+    collection_registry
+
+# shared by every store so a fan-out query does not pay for thread start-up
+_fan_out_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vector-fan-out")
+# chromadb's duckdb client is not thread-safe; concurrent queries fail with bogus NoDatapointsException
+_chroma_lock = threading.Lock()
+
+
+class VectorStore:
+    # hits are dicts with id, document, metadata, distance and, when asked for, embedding;
+    # distance is squared L2 between unit vectors (2 - 2 * cosine), the same scale chroma reports
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str],
+            metadatas: List[dict]) -> None:
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]) -> None:
+        raise NotImplementedError
+
+    def update_metadatas(self, ids: List[str], metadatas: List[dict]) -> None:
+        raise NotImplementedError
+
+    def get(self, where: Optional[dict] = None, include: tuple = ("documents", "metadatas")) -> dict[str, list]:
+        raise NotImplementedError
+
+    def query(self, query_embeddings: List[List[float]], n_results: int, where: Optional[dict] = None,
+              with_embeddings: bool = False) -> List[List[dict[str, Any]]]:
+        raise NotImplementedError
+
+    # one query embedding, one filtered lookup per where clause; the lookups run concurrently
+    def fan_out_query(self, query_embedding: List[float], wheres: List[Optional[dict]], n_results: int,
+                      with_embeddings: bool = False) -> List[List[dict[str, Any]]]:
+        def query(where: Optional[dict]) -> List[dict[str, Any]]:
+            return self.query([query_embedding], n_results, where, with_embeddings)[0]
+
+        if len(wheres) <= 1:
+            return [query(where) for where in wheres]
+        return list(_fan_out_pool.map(query, wheres))
+
+    def persist(self) -> None:
+        pass
+
+    def delete_all(self) -> None:
+        raise NotImplementedError
+
+    def warm_up(self) -> None:
+        pass
+
+
+class ChromaVectorStore(VectorStore):
+    _persist_dir: str
+    _collection_name: str
+    _registry: ChromaCollectionRegistry
+
+    def __init__(self, persist_dir: str, collection_name: str, registry: ChromaCollectionRegistry = None) -> None:
+        self._persist_dir = persist_dir
+        self._collection_name = collection_name
+        self._registry = registry if registry is not None else collection_registry
+
+    def _db(self):
+        return self._registry.get(self._persist_dir, self._collection_name)
+
+    def count(self) -> int:
+        with _chroma_lock:
+            return self._db()._collection.count()
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str],
+            metadatas: List[dict]) -> None:
+        with _chroma_lock:
+            self._db()._collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids: List[str]) -> None:
+        with _chroma_lock:
+            self._db()._collection.delete(ids=ids)
+
+    def update_metadatas(self, ids: List[str], metadatas: List[dict]) -> None:
+        with _chroma_lock:
+            self._db()._collection.update(ids=ids, metadatas=metadatas)
+
+    def get(self, where: Optional[dict] = None, include: tuple = ("documents", "metadatas")) -> dict[str, list]:
+        filter_kwargs = {"where": where} if where else {}
+        with _chroma_lock:
+            return self._db()._collection.get(include=list(include), **filter_kwargs)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int, where: Optional[dict] = None,
+              with_embeddings: bool = False) -> List[List[dict[str, Any]]]:
+        filter_kwargs = {"where": where} if where else {}
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_embeddings else [])
+        with _chroma_lock:
+            collection = self._db()._collection
+            # chroma raises when asked for more neighbours than match the filter, e.g. a source with few chunks
+            available = len(collection.get(include=[], **filter_kwargs)["ids"]) if where else collection.count()
+            n_results = min(n_results, available)
+            if n_results == 0:
+                return [[] for _ in query_embeddings]
+            result = collection.query(query_embeddings=query_embeddings, n_results=n_results, include=include,
+                                      **filter_kwargs)
+        hits = []
+        for i in range(len(query_embeddings)):
+            embeddings = result["embeddings"][i] if with_embeddings else [None] * len(result["ids"][i])
+            hits.append([
+                {"id": chunk_id, "document": document, "metadata": metadata, "distance": distance,
+                 "embedding": embedding}
+                for chunk_id, document, metadata, distance, embedding in zip(
+                    result["ids"][i], result["documents"][i], result["metadatas"][i], result["distances"][i],
+                    embeddings)
+            ])
+        return hits
+
+    # one source after another: the thread pool would only queue on the chroma lock
+    def fan_out_query(self, query_embedding: List[float], wheres: List[Optional[dict]], n_results: int,
+                      with_embeddings: bool = False) -> List[List[dict[str, Any]]]:
+        return [self.query([query_embedding], n_results, where, with_embeddings)[0] for where in wheres]
+
+    def persist(self) -> None:
+        with _chroma_lock:
+            self._db().persist()
+
+    def delete_all(self) -> None:
+        with _chroma_lock:
+            self._db().delete_collection()
+        self._registry.invalidate(self._persist_dir, self._collection_name)
+
+    def warm_up(self) -> None:
+        self._registry.warm_up([(self._persist_dir, self._collection_name)])
+
+
+def maximal_marginal_relevance(query: np.ndarray, embeddings: np.ndarray, k: int,
+                               lambda_mult: float = 0.5) -> List[int]:
+    if len(embeddings) == 0:
+        return []
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = embeddings @ query
+    similarity = embeddings @ embeddings.T
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(embeddings)):
+        redundancy = similarity[:, selected].max(axis=1)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
@@ -0,0 +1,58 @@
+import asyncio
+
+from kakao_developers_helper_bot import kakao_developers_helper_bot as app
+from kakao_developers_helper_bot.langchain_call.conversation_store import ConversationStore
+
+
+class RecordingAssistant:
+    def __init__(self) -> None:
+        self.conversation_ids = []
+
+    async def agenerate_answer(self, user_message, conversation_id: str = "fa1010", use_cache: bool = True) -> str:
+        self.conversation_ids.append(conversation_id)
+        return "answer"
+
+    async def astream_answer(self, user_message, conversation_id: str = "fa1010", use_cache: bool = True):
+        self.conversation_ids.append(conversation_id)
+        yield "answer"
+
+
+def make_state(token: str) -> app.State:
+    state = app.State()
+    state.router_data = {"token": token}
+    state.text = "카카오싱크 도입 절차"
+    return state
+
+
+async def run_handler(handler, state: app.State) -> None:
+    async for _ in handler.fn(state):
+        pass
+
+
+def test_posted_turns_are_stored_per_session(monkeypatch, tmp_path) -> None:
+    assistant = RecordingAssistant()
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    monkeypatch.setattr(app.langchain_assistant, "get", lambda: assistant)
+    monkeypatch.setattr(app.chat_store, "get", lambda: store)
+    state = make_state("session-1")
+    state.stream = False
+
+    asyncio.run(run_handler(app.State.lang_chain_call, state))
+    asyncio.run(app.State.load_messages.fn(state))
+
+    assert assistant.conversation_ids == ["ui-session-1"]
+    assert [(m.question, m.answer) for m in state.messages] == [(state.text, "answer")]
+    assert store.turns("ui-session-2", app.message_page_size) == []
+
+
+def test_streamed_turns_use_the_session_conversation(monkeypatch, tmp_path) -> None:
+    assistant = RecordingAssistant()
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    monkeypatch.setattr(app.langchain_assistant, "get", lambda: assistant)
+    monkeypatch.setattr(app.chat_store, "get", lambda: store)
+    state = make_state("session-1")
+
+    asyncio.run(run_handler(app.State.lang_chain_call, state))
+
+    assert assistant.conversation_ids == ["ui-session-1"]
+    assert [turn["answer"] for turn in store.turns("ui-session-1", app.message_page_size)] == ["answer"]
@@ -0,0 +1,21 @@
+import importlib
+
+import pytest
+
+# every module the app and the backend load at start-up, against the versions pinned in poetry.lock
+MODULES = [
+    "kakao_developers_helper_bot.langchain_call.chroma_collection_registry",
+    "kakao_developers_helper_bot.langchain_call.chroma_db_repository",
+    "kakao_developers_helper_bot.langchain_call.embedding_cache",
+    "kakao_developers_helper_bot.langchain_call.lang_chain_assistant",
+    "kakao_developers_helper_bot.langchain_call.llm_gateway",
+    "kakao_developers_helper_bot.langchain_call.semantic_answer_cache",
+    "kakao_developers_helper_bot.langchain_call.vector_store",
+    "kakao_developers_helper_bot.benchmark.fakes",
+    "kakao_developers_helper_bot.backend",
+]
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_module_imports(module: str) -> None:
+    importlib.import_module(module)
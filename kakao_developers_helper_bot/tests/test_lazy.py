@@ -0,0 +1,22 @@
+import asyncio
+import threading
+
+from kakao_developers_helper_bot.langchain_call.lazy import Lazy
+
+
+def test_aget_initializes_off_the_event_loop() -> None:
+    factory_threads = []
+
+    def factory() -> str:
+        factory_threads.append(threading.current_thread())
+        return "store"
+
+    lazy = Lazy("store", factory)
+
+    async def run():
+        return await lazy.aget(), await lazy.aget(), threading.current_thread()
+
+    first, second, loop_thread = asyncio.run(run())
+
+    assert (first, second) == ("store", "store")
+    assert len(factory_threads) == 1 and factory_threads[0] is not loop_thread
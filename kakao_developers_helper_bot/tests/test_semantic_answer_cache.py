@@ -0,0 +1,13 @@
+from kakao_developers_helper_bot.benchmark.fakes import FakeEmbeddings
+from kakao_developers_helper_bot.langchain_call.chroma_collection_registry import ChromaCollectionRegistry
+from kakao_developers_helper_bot.langchain_call.semantic_answer_cache import SemanticAnswerCache
+
+
+def test_lookup_with_fewer_entries_than_k_in_either_mode(tmp_path) -> None:
+    registry = ChromaCollectionRegistry(embedding_factory=lambda: FakeEmbeddings(latency=0))
+    cache = SemanticAnswerCache(str(tmp_path), lambda: "v1", registry=registry)
+    cache.store("카카오싱크 도입 절차", "도입 안내 페이지를 참고하세요", "select_vector_db")
+
+    assert cache.lookup("카카오싱크 도입 절차", "select_vector_db") == "도입 안내 페이지를 참고하세요"
+    # no entry has this mode yet
+    assert cache.lookup("카카오싱크 도입 절차", "lang_chain_call") is None
@@ -0,0 +1,24 @@
+import asyncio
+
+from kakao_developers_helper_bot.langchain_call.speculative_retrieval import SpeculativeRetrieval
+
+
+async def fetch(result: str, seconds: float) -> str:
+    await asyncio.sleep(seconds)
+    return result
+
+
+def test_peek_returns_only_finished_prefetches() -> None:
+    async def run():
+        speculation = SpeculativeRetrieval()
+        speculation.prefetch("fast", lambda: fetch("fast", 0))
+        speculation.prefetch("slow", lambda: fetch("slow", 10))
+        await asyncio.sleep(0.01)
+        peeked = speculation.peek("fast"), speculation.peek("slow"), speculation.peek("missing")
+        speculation.discard("slow")
+        # a discarded key is fetched again on demand
+        fetched = await speculation.get("slow", lambda: fetch("refetched", 0))
+        speculation.cancel()
+        return peeked, fetched
+
+    assert asyncio.run(run()) == (("fast", None, None), "refetched")
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+# question/answer pairs shown in a chat UI, paged by id so a session never has to load all of them
+class ChatHistory:
+    _db_path: str
+    _local: threading.local
+
+    def __init__(self, db_path: str) -> None:
+        self._db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "conversation_id TEXT NOT NULL, "
+                "question TEXT NOT NULL, "
+                "answer TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS turns_conversation_id ON turns (conversation_id, id)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._db_path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def append_turn(self, conversation_id: str, question: str, answer: str) -> int:
+        with self._connection() as connection:
+            cursor = connection.execute(
+                "INSERT INTO turns (conversation_id, question, answer, created_at) VALUES (?, ?, ?, ?)",
+                (conversation_id, question, answer, time.time()),
+            )
+        return cursor.lastrowid
+
+    # newest first; before_id pages towards older turns, after_id back towards the latest ones
+    def turns(self, conversation_id: str, limit: int, before_id: int = None, after_id: int = None) -> list[dict]:
+        if after_id is not None:
+            rows = self._connection().execute(
+                "SELECT * FROM (SELECT id, question, answer, created_at FROM turns "
+                "WHERE conversation_id = ? AND id > ? ORDER BY id LIMIT ?) ORDER BY id DESC",
+                (conversation_id, after_id, limit),
+            ).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT id, question, answer, created_at FROM turns WHERE conversation_id = ? AND id < ? "
+                "ORDER BY id DESC LIMIT ?",
+                (conversation_id, before_id if before_id is not None else 2 ** 63 - 1, limit),
+            ).fetchall()
+        return [{"id": row[0], "question": row[1], "answer": row[2], "created_at": row[3]} for row in rows]
+
+    def has_turns(self, conversation_id: str, before_id: int = None, after_id: int = None) -> bool:
+        if after_id is not None:
+            query, bound = "SELECT 1 FROM turns WHERE conversation_id = ? AND id > ? LIMIT 1", after_id
+        else:
+            query, bound = "SELECT 1 FROM turns WHERE conversation_id = ? AND id < ? LIMIT 1", before_id
+        return self._connection().execute(query, (conversation_id, bound)).fetchone() is not None
@@ -0,0 +1,377 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, TypeVar
+
+import aiohttp
+import openai
+import requests
+import tiktoken
+from requests.adapters import HTTPAdapter
+
+T = TypeVar("T")
+
+# per-request transport options, not part of what the model is asked
+UNCACHED_PARAMS = {"stream", "request_timeout"}
+
+
+class Completion:
+    model: str
+    content: Optional[str]
+    function_call: Optional[dict]
+    prompt_tokens: int
+    completion_tokens: int
+    cached: bool = False
+
+    def __init__(self, model: str, content: Optional[str], function_call: Optional[dict], prompt_tokens: int,
+                 completion_tokens: int) -> None:
+        self.model = model
+        self.content = content
+        self.function_call = function_call
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    def as_cached(self) -> "Completion":
+        completion = Completion(self.model, self.content, self.function_call, self.prompt_tokens,
+                                self.completion_tokens)
+        completion.cached = True
+        return completion
+
+    # a cache hit is replayed as a single chunk shaped like a streamed delta
+    def delta(self) -> dict:
+        delta = {"role": "assistant"}
+        if self.content:
+            delta["content"] = self.content
+        if self.function_call:
+            delta["function_call"] = dict(self.function_call)
+        return delta
+
+
+class CallRecord:
+    model: str
+    latency_ms: float
+    first_token_ms: Optional[float]
+    prompt_tokens: int
+    completion_tokens: int
+    cached: bool
+    error: Optional[str]
+
+    def __init__(self, model: str, latency_ms: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                 cached: bool = False, first_token_ms: Optional[float] = None, error: Optional[str] = None) -> None:
+        self.model = model
+        self.latency_ms = latency_ms
+        self.first_token_ms = first_token_ms
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached = cached
+        self.error = error
+
+    def to_dict(self) -> dict[str, Any]:
+        return dict(vars(self))
+
+
+class ChatStream:
+    cached: bool
+    _deltas: AsyncIterator[dict]
+
+    def __init__(self, deltas: AsyncIterator[dict], cached: bool) -> None:
+        self._deltas = deltas
+        self.cached = cached
+
+    def __aiter__(self) -> AsyncIterator[dict]:
+        return self._deltas
+
+
+class LlmClient:
+    request_timeout: float
+    stream_timeout: float
+    _max_connections: int
+    _keepalive_seconds: float
+    _cache_size: int
+    _cache_ttl_seconds: float
+    _cache: "OrderedDict[str, tuple[float, Completion]]"
+    _limiter: Any
+    _count_tokens: Optional[Callable[[str], int]]
+    _encoding: tiktoken.Encoding = None
+    _records: "deque[CallRecord]"
+    _requests_session: Optional[requests.Session] = None
+    _aiohttp_sessions: dict[asyncio.AbstractEventLoop, aiohttp.ClientSession]
+    _lock: threading.Lock
+
+    def __init__(self, request_timeout: float = 60.0, stream_timeout: float = 180.0, max_connections: int = 20,
+                 keepalive_seconds: float = 60.0, cache_size: int = 512, cache_ttl_seconds: float = 3600.0,
+                 limiter: Any = None, count_tokens: Callable[[str], int] = None, history: int = 1000) -> None:
+        # limiter: anything with call / acall / astream(fn, tokens), e.g. a rate-limiting gateway
+        self.request_timeout = request_timeout
+        self.stream_timeout = stream_timeout
+        self._max_connections = max_connections
+        self._keepalive_seconds = keepalive_seconds
+        self._cache_size = cache_size
+        self._cache_ttl_seconds = cache_ttl_seconds
+        self._cache = OrderedDict()
+        self._limiter = limiter
+        self._count_tokens = count_tokens
+        self._records = deque(maxlen=history)
+        self._aiohttp_sessions = {}
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        if self._count_tokens is not None:
+            return self._count_tokens(text)
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+        return len(self._encoding.encode(text))
+
+    def count_message_tokens(self, messages: List[dict]) -> int:
+        tokens = 0
+        for message in messages:
+            tokens += self.count_tokens(message.get("content") or "")
+            if message.get("function_call"):
+                tokens += self.count_tokens(message["function_call"].get("arguments", ""))
+        return tokens
+
+    @staticmethod
+    def cache_key(model: str, messages: List[dict], params: dict) -> str:
+        params = {key: value for key, value in params.items() if key not in UNCACHED_PARAMS}
+        payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True,
+                             ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: Optional[str]) -> Optional[Completion]:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self._cache_ttl_seconds:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def _cache_put(self, key: Optional[str], completion: Completion) -> None:
+        if key is None or self._cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = (time.time(), completion)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def record(self, model: str, latency_ms: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+               cached: bool = False, first_token_ms: Optional[float] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._records.append(CallRecord(model, latency_ms, prompt_tokens, completion_tokens, cached,
+                                            first_token_ms, error))
+
+    def records(self) -> List[CallRecord]:
+        with self._lock:
+            return list(self._records)
+
+    def stats(self) -> dict[str, Any]:
+        records = self.records()
+        latencies = sorted(record.latency_ms for record in records if not record.cached and record.error is None)
+        with self._lock:
+            cache_entries = len(self._cache)
+        return {
+            "calls": len(records),
+            "cache_hits": sum(record.cached for record in records),
+            "errors": sum(record.error is not None for record in records),
+            "prompt_tokens": sum(record.prompt_tokens for record in records if not record.cached),
+            "completion_tokens": sum(record.completion_tokens for record in records if not record.cached),
+            "latency_p50_ms": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_p99_ms": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] if latencies else 0.0,
+            "cache_entries": cache_entries,
+        }
+
+    def _install_requests_session(self) -> None:
+        # openai keeps one session per thread and hands it this one, so every thread shares the keep-alive pool
+        if self._requests_session is not None:
+            return
+        with self._lock:
+            if self._requests_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self._max_connections)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._requests_session = session
+                openai.requestssession = session
+
+    def _aiohttp_session(self) -> aiohttp.ClientSession:
+        # aiohttp sessions belong to one event loop; without one openai opens a new connection per call
+        loop = asyncio.get_running_loop()
+        session = self._aiohttp_sessions.get(loop)
+        if session is None or session.closed:
+            for closed_loop in [other for other in self._aiohttp_sessions if other.is_closed()]:
+                del self._aiohttp_sessions[closed_loop]
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+                limit=self._max_connections, keepalive_timeout=self._keepalive_seconds))
+            self._aiohttp_sessions[loop] = session
+        return session
+
+    @asynccontextmanager
+    async def pooled(self) -> AsyncIterator[aiohttp.ClientSession]:
+        # openai (and LangChain's ChatOpenAI, which calls it) picks the session up from this context variable
+        session = self._aiohttp_session()
+        token = openai.aiosession.set(session)
+        try:
+            yield session
+        finally:
+            openai.aiosession.reset(token)
+
+    # asyncio.run gives every call its own loop, so that loop's session is closed before the loop goes away
+    def run(self, awaitable: Awaitable[T]) -> T:
+        async def run_and_close() -> T:
+            try:
+                return await awaitable
+            finally:
+                session = self._aiohttp_sessions.pop(asyncio.get_running_loop(), None)
+                if session is not None and not session.closed:
+                    await session.close()
+
+        return asyncio.run(run_and_close())
+
+    async def aclose(self) -> None:
+        sessions, self._aiohttp_sessions = self._aiohttp_sessions, {}
+        for session in sessions.values():
+            if not session.closed:
+                await session.close()
+        if self._requests_session is not None:
+            self._requests_session.close()
+
+    def _invoke(self, fn: Callable[[], T], tokens: int) -> T:
+        return self._limiter.call(fn, tokens) if self._limiter is not None else fn()
+
+    async def _ainvoke(self, fn: Callable[[], Awaitable[T]], tokens: int) -> T:
+        return await self._limiter.acall(fn, tokens) if self._limiter is not None else await fn()
+
+    # the limiter's slot is held until the stream is read to the end or abandoned, not just until it opens
+    async def _ainvoke_stream(self, fn: Callable[[], Awaitable[AsyncIterator[T]]], tokens: int) -> AsyncIterator[T]:
+        if self._limiter is not None:
+            async for item in self._limiter.astream(fn, tokens):
+                yield item
+            return
+        async for item in await fn():
+            yield item
+
+    async def _acreate(self, **kwargs: Any) -> Any:
+        async with self.pooled():
+            return await openai.ChatCompletion.acreate(**kwargs)
+
+    def _reserved_tokens(self, prompt_tokens: int, params: dict) -> int:
+        # openai counts max_tokens against the tokens-per-minute limit
+        return prompt_tokens + (params.get("max_tokens") or 0)
+
+    # returns the cache key (None when this call must not be cached) and the cached completion, if any
+    def _lookup(self, model: str, messages: List[dict], cache: bool, params: dict) -> tuple:
+        if not cache or params.get("n", 1) != 1:
+            return None, None
+        key = self.cache_key(model, messages, params)
+        completion = self._cache_get(key)
+        if completion is None:
+            return key, None
+        self.record(model, 0.0, completion.prompt_tokens, completion.completion_tokens, cached=True)
+        return key, completion.as_cached()
+
+    @staticmethod
+    def _from_response(model: str, response: Any) -> Completion:
+        message = response["choices"][0]["message"]
+        usage = response.get("usage") or {}
+        function_call = message.get("function_call")
+        return Completion(model, message.get("content"), dict(function_call) if function_call else None,
+                          usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+
+    def chat(self, messages: List[dict], model: str = "gpt-3.5-turbo", cache: bool = True,
+             **params: Any) -> Completion:
+        key, completion = self._lookup(model, messages, cache, params)
+        if completion is not None:
+            return completion
+
+        self._install_requests_session()
+        started_at = time.perf_counter()
+        try:
+            response = self._invoke(lambda: openai.ChatCompletion.create(
+                model=model, messages=messages, request_timeout=self.request_timeout, **params,
+            ), self._reserved_tokens(self.count_message_tokens(messages), params))
+        except Exception as e:
+            self.record(model, (time.perf_counter() - started_at) * 1000, error=type(e).__name__)
+            raise
+        completion = self._from_response(model, response)
+        self.record(model, (time.perf_counter() - started_at) * 1000, completion.prompt_tokens,
+                    completion.completion_tokens)
+        self._cache_put(key, completion)
+        return completion
+
+    async def achat(self, messages: List[dict], model: str = "gpt-3.5-turbo", cache: bool = True,
+                    **params: Any) -> Completion:
+        key, completion = self._lookup(model, messages, cache, params)
+        if completion is not None:
+            return completion
+
+        started_at = time.perf_counter()
+        try:
+            response = await self._ainvoke(lambda: self._acreate(
+                model=model, messages=messages, request_timeout=self.request_timeout, **params,
+            ), self._reserved_tokens(self.count_message_tokens(messages), params))
+        except Exception as e:
+            self.record(model, (time.perf_counter() - started_at) * 1000, error=type(e).__name__)
+            raise
+        completion = self._from_response(model, response)
+        self.record(model, (time.perf_counter() - started_at) * 1000, completion.prompt_tokens,
+                    completion.completion_tokens)
+        self._cache_put(key, completion)
+        return completion
+
+    async def astream_chat(self, messages: List[dict], model: str = "gpt-3.5-turbo", cache: bool = True,
+                           **params: Any) -> ChatStream:
+        key, completion = self._lookup(model, messages, cache, params)
+        if completion is not None:
+            return ChatStream(self._areplay(completion), cached=True)
+
+        prompt_tokens = self.count_message_tokens(messages)
+        started_at = time.perf_counter()
+        response = self._ainvoke_stream(lambda: self._acreate(
+            model=model, messages=messages, request_timeout=self.stream_timeout, stream=True, **params,
+        ), self._reserved_tokens(prompt_tokens, params))
+        return ChatStream(self._aconsume(response, model, key, prompt_tokens, started_at), cached=False)
+
+    @staticmethod
+    async def _areplay(completion: Completion) -> AsyncIterator[dict]:
+        yield completion.delta()
+
+    async def _aconsume(self, response: AsyncIterator[Any], model: str, key: Optional[str], prompt_tokens: int,
+                        started_at: float) -> AsyncIterator[dict]:
+        content, function_name, arguments = "", None, ""
+        first_token_ms = None
+        try:
+            async for chunk in response:
+                delta = chunk["choices"][0]["delta"]
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started_at) * 1000
+                if "function_call" in delta:
+                    function_name = (function_name or "") + delta["function_call"].get("name", "")
+                    arguments += delta["function_call"].get("arguments", "")
+                elif delta.get("content"):
+                    content += delta["content"]
+                yield delta
+        except Exception as e:
+            self.record(model, (time.perf_counter() - started_at) * 1000, prompt_tokens,
+                        first_token_ms=first_token_ms, error=type(e).__name__)
+            raise
+
+        # only a stream read to the end is accounted and cached; an abandoned one never gets here
+        function_call = {"name": function_name, "arguments": arguments} if function_name is not None else None
+        completion = Completion(model, content or None, function_call, prompt_tokens,
+                                self.count_tokens(content + arguments))
+        self.record(model, (time.perf_counter() - started_at) * 1000, prompt_tokens, completion.completion_tokens,
+                    first_token_ms=first_token_ms)
+        self._cache_put(key, completion)
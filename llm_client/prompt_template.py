@@ -0,0 +1,26 @@
+import functools
+
+from langchain.chains import LLMChain
+from langchain.prompts import ChatPromptTemplate
+
+
+@functools.lru_cache(maxsize=None)
+def read_prompt_template(file_path: str) -> str:
+    with open(file_path, "r", encoding="utf-8") as f:
+        prompt_template = f.read()
+
+    return prompt_template
+
+
+@functools.lru_cache(maxsize=None)
+def load_chat_prompt_template(file_path: str) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_template(template=read_prompt_template(file_path))
+
+
+def create_chain(llm, template_path: str, output_key: str, verbose: bool = False) -> LLMChain:
+    return LLMChain(
+        llm=llm,
+        prompt=load_chat_prompt_template(template_path),
+        output_key=output_key,
+        verbose=verbose,
+    )
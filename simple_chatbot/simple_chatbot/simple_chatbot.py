@@ -7,50 +7,94 @@ from pynecone import Base
 from pcconfig import config
 
 import pynecone as pc
+from llm_client.chat_history import ChatHistory
+from llm_client.client import LlmClient
 
 docs_url = "https://pynecone.io/docs/getting-started/introduction"
 filename = f"{config.app_name}/{config.app_name}.py"
 
 openai.api_key = os.environ['OPENAI_API_KEY']
+llm_client = LlmClient()
+chat_history = ChatHistory(os.path.join(os.getcwd(), "assets/history/conversations.db"))
+# number of turns a session keeps in State.messages; older ones are paged in from chat_history
+message_page_size = 20
 
 
 def call_assistant(text) -> str:
     system_instruction = f"You are a helpful assistant."
     messages = [{"role": "system", "content": system_instruction}, {"role": "user", "content": text}]
 
-    response = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=messages)
-    answer = response['choices'][0]['message']['content']
-
-    return answer
+    return llm_client.chat(messages, model="gpt-3.5-turbo").content
 
 
 class Message(Base):
+    id: int = 0
     question: str
     answer: str
     created_at: str
 
 
+def to_message(turn: dict) -> Message:
+    return Message(
+        id=turn["id"],
+        question=turn["question"],
+        answer=turn["answer"],
+        created_at=datetime.fromtimestamp(turn["created_at"]).strftime("%B %d, %Y %I:%M %p"),
+    )
+
+
+# pynecone turns public State methods into event handlers and underscore names into backend vars,
+# so the helpers the handlers share take the state as an argument instead
+def answer_question(state: "State") -> str:
+    if not state.text.strip():
+        return "Advise will appear here."
+    answer = call_assistant(state.text)
+    state.answer = answer
+    return answer
+
+
+def load_page(state: "State", before_id: int = None, after_id: int = None):
+    conversation_id = state.get_token()
+    turns = chat_history.turns(conversation_id, message_page_size, before_id, after_id)
+    if after_id is not None and len(turns) < message_page_size:
+        turns = chat_history.turns(conversation_id, message_page_size)
+    state.messages = [to_message(turn) for turn in turns]
+    state.has_older = bool(turns) and chat_history.has_turns(conversation_id, before_id=turns[-1]["id"])
+    state.has_newer = bool(turns) and chat_history.has_turns(conversation_id, after_id=turns[0]["id"])
+
+
 class State(pc.State):
     text: str = ""
     messages: list[Message] = []
     answer: str = ""
+    has_older: bool = False
+    has_newer: bool = False
 
-    def output(self) -> str:
-        if not self.text.strip():
-            return "Advise will appear here."
-        answer = call_assistant(self.text)
-        self.answer = answer
-        return answer
+    def load_messages(self):
+        load_page(self)
+
+    def load_older(self):
+        if self.messages:
+            load_page(self, before_id=self.messages[-1].id)
+
+    def load_newer(self):
+        if self.messages:
+            load_page(self, after_id=self.messages[0].id)
 
     def post(self):
-        self.messages = \
-            [
-                Message(
-                    question=self.text,
-                    answer=self.output(),
-                    created_at=datetime.now().strftime("%B %d, %Y %I:%M %p"),
-                )
-            ] + self.messages
+        if self.has_newer:
+            load_page(self)
+        question = self.text
+        answer = answer_question(self)
+        message = Message(
+            id=chat_history.append_turn(self.get_token(), question, answer),
+            question=question,
+            answer=answer,
+            created_at=datetime.now().strftime("%B %d, %Y %I:%M %p"),
+        )
+        # the window is capped, so the copy and the payload sent to the browser stay the same size
+        self.has_older = self.has_older or len(self.messages) >= message_page_size
+        self.messages = [message] + self.messages[:message_page_size - 1]
 
 
 def header():
@@ -142,7 +186,9 @@ def index() -> pc.Component:
         output(),
         pc.button("Post", on_click=State.post, margin_top="1rem"),
         pc.vstack(
+            pc.cond(State.has_newer, pc.button("Load Newer", on_click=State.load_newer)),
             pc.foreach(State.messages, message),
+            pc.cond(State.has_older, pc.button("Load Older", on_click=State.load_older)),
             margin_top="2rem",
             spacing="1rem",
             align_items="left"
@@ -154,5 +200,5 @@ def index() -> pc.Component:
 
 # Add state and page to the app.
 app = pc.App(state=State)
-app.add_page(index)
+app.add_page(index, on_load=State.load_messages)
 app.compile()